@@ -0,0 +1,113 @@
+import asyncio
+import heapq
+import itertools
+import os
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from metrics import metrics
+
+# Lower number goes first. Sessions that already gave us payment details are
+# the ones worth spending LLM capacity on.
+PRIORITY_INTEL = 0
+PRIORITY_ENGAGED = 1
+PRIORITY_NEW = 2
+
+
+class AdmissionController:
+    """
+    Bounds the turns that may use the LLM at once. Beyond `max_inflight`,
+    turns wait in a priority backlog of at most `max_backlog`; when it is
+    full, a newcomer displaces the lowest-priority waiter or is shed itself.
+    A turn that waited `max_wait` seconds without a slot is shed too. Shed
+    turns are answered locally, so latency stays bounded while the provider
+    is slow. `paused` reports how long the provider has told us to stay away
+    (Retry-After); when that is longer than `max_wait`, turns are shed
+    without queueing at all.
+    """
+    def __init__(self, max_inflight: Optional[int] = None, max_backlog: Optional[int] = None,
+                 max_wait: Optional[float] = None, paused: Optional[Callable[[], float]] = None):
+        self.max_inflight = max_inflight or int(os.getenv("ADMISSION_MAX_INFLIGHT", "32"))
+        self.max_backlog = max_backlog if max_backlog is not None else int(os.getenv("ADMISSION_MAX_BACKLOG", "64"))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("ADMISSION_MAX_WAIT", "2"))
+        self._paused = paused
+        self._inflight = 0
+        # Only waiters still waiting: entries leave the heap as soon as they are granted, displaced or give up
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.shed = 0
+
+    @property
+    def backlog(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int) -> bool:
+        """True if the turn may use the LLM (call release() after), False if shed."""
+        if self._paused is not None and self._paused() > self.max_wait:
+            return self._shed("paused")
+        if self._inflight < self.max_inflight and not self.backlog:
+            self._inflight += 1
+            return self._admitted()
+
+        if len(self._waiters) >= self.max_backlog:
+            # Newest of the lowest priority goes first
+            worst = max(self._waiters, default=None)
+            if worst is None or worst[0] <= priority:
+                return self._shed("backlog")
+            self._drop(worst)
+            worst[2].set_result(False)
+            self._shed("displaced")
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), fut)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait({fut}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            if not fut.done():
+                self._drop(entry)
+            elif fut.result():
+                self.release() # Got a slot just as we were cancelled; pass it on
+            fut.cancel()
+            raise
+        if not fut.done():
+            self._drop(entry)
+            fut.cancel()
+            return self._shed("timeout")
+        if fut.result():
+            return self._admitted()
+        return False # Displaced by a higher priority turn; already counted
+
+    def _admitted(self) -> bool:
+        self.admitted += 1
+        metrics.incr("admission", "admitted")
+        return True
+
+    def _shed(self, reason: str) -> bool:
+        self.shed += 1
+        metrics.incr("admission", reason)
+        return False
+
+    def _drop(self, entry: Tuple[int, int, asyncio.Future]):
+        # The backlog is bounded by max_backlog, so a linear removal is cheap
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+
+    def release(self):
+        self._inflight -= 1
+        if self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            self._inflight += 1
+            fut.set_result(True)
+
+    @asynccontextmanager
+    async def admit(self, priority: int):
+        admitted = await self.acquire(priority)
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": self._inflight, "backlog": self.backlog, "admitted": self.admitted, "shed": self.shed}
@@ -1,46 +1,97 @@
 import os
-from openai import AsyncOpenAI
-from typing import Optional
+from llm import gateway
+from typing import AsyncIterator, Optional
 from memory import MemoryManager
 from persona import PersonaManager
+from context import ContextManager
+from local_replies import LocalReplyGenerator
+from extractor import extract_regex
+from logs import get_logger
+from metrics import metrics
+
+log = get_logger("agent")
 
 class HoneypotAgent:
-    def __init__(self, memory_manager: MemoryManager, persona_manager: PersonaManager):
+    def __init__(self, memory_manager: MemoryManager, persona_manager: PersonaManager,
+                 context_manager: Optional[ContextManager] = None):
         self.memory = memory_manager
         self.persona = persona_manager
+        self.context = context_manager or ContextManager(memory_manager)
+        self.local = LocalReplyGenerator(persona_manager)
         self.api_key = os.getenv("OPENAI_API_KEY")
-        self.base_url = os.getenv("OPENAI_BASE_URL")
         self.model = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
         
-        if self.base_url:
-             self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
-        else:
-             self.client = AsyncOpenAI(api_key=self.api_key)
+        # Shared pooled client; see llm.py
+        self.llm = gateway
 
     async def generate_reply(self, session_id: str, user_message: str) -> str:
-        self.memory.add_message(session_id, "user", user_message)
-        
+        reply = await self.draft_reply(session_id, user_message)
+        self.commit_reply(session_id, user_message, reply)
+        return reply
+
+    async def draft_reply(self, session_id: str, user_message: str) -> str:
+        """
+        Generates a reply without touching memory, so the pipeline can start it
+        speculatively and throw it away if the message turns out to be SAFE.
+        """
         history = self.memory.get_history(session_id)
         system_prompt = self.persona.get_system_prompt(session_id)
         
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(history)
+        # Token-budgeted: summary of older turns + pinned identifier turns + recent turns
+        messages = self.context.build(session_id, system_prompt, history, user_message)
 
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model, 
-                messages=messages,
-                temperature=0.7, 
-                max_tokens=100
-            )
-
-            reply = response.choices[0].message.content
-            self.memory.add_message(session_id, "assistant", reply)
-            
-            return reply
+            with metrics.timer("reply"):
+                response = await self.llm.chat(
+                    "reply",
+                    model=self.model, 
+                    messages=messages,
+                    temperature=0.7, 
+                    max_tokens=100
+                )
+
+            return response.choices[0].message.content
+
+        except Exception as e:
+            log.warning("Reply generation failed, using fallback", session=session_id, error=repr(e))
+            metrics.incr("fallbacks", "reply")
+            return self.fallback_reply(session_id, user_message)
 
+    async def stream_reply(self, session_id: str, user_message: str) -> AsyncIterator[str]:
+        """
+        Streaming draft_reply(): yields the reply in chunks as the model produces
+        them. Like draft_reply() it does not touch memory.
+        """
+        history = self.memory.get_history(session_id)
+        system_prompt = self.persona.get_system_prompt(session_id)
+        messages = self.context.build(session_id, system_prompt, history, user_message)
+
+        produced = False
+        try:
+            with metrics.timer("reply"):
+                async for delta in self.llm.chat_stream(
+                    "reply",
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=100
+                ):
+                    produced = True
+                    yield delta
         except Exception as e:
-            print(f"Agent Generation Error: {e}")
-            fallback = "I am sorry, I did not understand. Can you explain about the payment again?"
-            self.memory.add_message(session_id, "assistant", fallback)
-            return fallback
+            log.warning("Reply stream failed", session=session_id, produced=produced, error=repr(e))
+            if not produced:
+                metrics.incr("fallbacks", "reply")
+                yield self.fallback_reply(session_id, user_message)
+
+    def fallback_reply(self, session_id: str, user_message: str = "") -> str:
+        """Local, persona-aware reply for when the LLM can't be used."""
+        # Count what this message already gave us, so we don't ask for it again
+        extracted = self.memory.get_extracted(session_id)
+        for kind, values in extract_regex(user_message).items() if user_message else ():
+            extracted[kind] = extracted.get(kind, []) + values
+        return self.local.reply(session_id, self.memory.get_history(session_id), extracted, user_message)
+
+    def commit_reply(self, session_id: str, user_message: str, reply: str):
+        self.memory.add_message(session_id, "user", user_message)
+        self.memory.add_message(session_id, "assistant", reply)
@@ -0,0 +1,188 @@
+import os
+import json
+from llm import gateway
+from typing import Dict, List, Optional, Tuple
+from cache import result_cache, scrub_identifiers
+from logs import get_logger
+from metrics import metrics
+
+log = get_logger("analyzer")
+
+INTEL_KEYS = ["bankAccounts", "upiIds", "phishingLinks", "phoneNumbers", "suspiciousKeywords"]
+LABELS = ["SCAM", "SUSPICIOUS", "SAFE"]
+
+
+class FusedAnalyzer:
+    """
+    Classification and intelligence extraction in one structured LLM call.
+    Saves the duplicate input tokens and the second round trip of running
+    ScamClassifier and IntelligenceExtractor separately.
+    """
+    def __init__(self):
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        self.model = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+
+        # Shared pooled client; see llm.py
+        self.llm = gateway
+
+    async def analyze(self, text: str) -> Optional[Tuple[Tuple[bool, float, str], Dict[str, list]]]:
+        """
+        Returns ((is_scam, confidence, label), llm_intelligence), or None if the
+        call failed or the output was malformed so the caller can fall back to
+        the separate classifier/extractor calls.
+        """
+        try:
+            if not self.api_key:
+                return None
+
+            with metrics.timer("analyze"):
+                fused, fresh = await result_cache.get_or_compute(
+                    result_cache.key("analyze", text),
+                    lambda: self._request_analysis(text)
+                )
+            if fresh:
+                return fused
+            verdict, intel = fused
+            return verdict, scrub_identifiers(intel, text)
+
+        except Exception as e:
+            log.warning("Fused analysis failed", error=repr(e))
+            metrics.incr("fallbacks", "analyze")
+            return None
+
+    async def _request_analysis(self, text: str) -> Tuple[Tuple[bool, float, str], Dict[str, list]]:
+        prompt = f"""
+        Analyze the following message.
+        1. Classify it into one of these categories:
+           SCAM (Phishing, Lottery, Urgent Money Request, Job Scam, etc.)
+           SUSPICIOUS (Unsolicited, vague requests, strange links)
+           SAFE (Normal conversation, greeting, relevant query)
+        2. Extract scam intelligence from it.
+
+        Return a JSON object:
+        {{
+            "label": "SCAM" | "SUSPICIOUS" | "SAFE",
+            "confidence": 0.0 to 1.0,
+            "bankAccounts": [], "upiIds": [], "phishingLinks": [], "phoneNumbers": [],
+            "suspiciousKeywords": []
+        }}
+        List values must be LISTS of strings. Return empty list [] if nothing found.
+        "suspiciousKeywords": specific urgent/scam words used (e.g. "blocked", "verify", "expire").
+
+        Message: "{text}"
+        """
+
+        response = await self.llm.chat(
+            "analyze",
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "You are an expert cybersecurity AI and data extractor. Output only valid JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0,
+            response_format={"type": "json_object"}
+        )
+
+        content = response.choices[0].message.content
+        if "```" in content:
+            content = content.replace("```json", "").replace("```", "")
+
+        parsed = self.parse(json.loads(content))
+        if parsed is None:
+            # Raise rather than return so malformed output is never cached
+            raise ValueError(f"Malformed fused output: {content[:200]}")
+        return parsed
+
+    async def analyze_many(self, texts: List[str]) -> List[Optional[Tuple[Tuple[bool, float, str], Dict[str, list]]]]:
+        """
+        Packs several short messages into one call. Returns one entry per
+        input, None where the model's answer for that message was missing or
+        malformed (or the whole call failed).
+        """
+        if not texts:
+            return []
+        if len(texts) == 1:
+            return [await self.analyze(texts[0])]
+
+        try:
+            if not self.api_key:
+                return [None] * len(texts)
+
+            numbered = "\n".join(f"[{i}] {json.dumps(text)}" for i, text in enumerate(texts))
+            prompt = f"""
+            Analyze each of the following numbered messages independently.
+            For each one, classify it as SCAM (Phishing, Lottery, Urgent Money Request, Job Scam, etc.),
+            SUSPICIOUS (Unsolicited, vague requests, strange links) or SAFE (Normal conversation),
+            and extract scam intelligence from it.
+
+            Return a JSON object:
+            {{
+                "results": [
+                    {{
+                        "index": <message number>,
+                        "label": "SCAM" | "SUSPICIOUS" | "SAFE",
+                        "confidence": 0.0 to 1.0,
+                        "bankAccounts": [], "upiIds": [], "phishingLinks": [], "phoneNumbers": [],
+                        "suspiciousKeywords": []
+                    }}
+                ]
+            }}
+            List values must be LISTS of strings found in that message only.
+
+            Messages:
+            {numbered}
+            """
+
+            response = await self.llm.chat(
+                "analyze",
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "You are an expert cybersecurity AI and data extractor. Output only valid JSON."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0,
+                response_format={"type": "json_object"}
+            )
+
+            content = response.choices[0].message.content
+            if "```" in content:
+                content = content.replace("```json", "").replace("```", "")
+            items = json.loads(content).get("results", [])
+        except Exception as e:
+            log.warning("Packed analysis failed", messages=len(texts), error=repr(e))
+            metrics.incr("fallbacks", "analyze")
+            return [None] * len(texts)
+
+        results: List[Optional[Tuple[Tuple[bool, float, str], Dict[str, list]]]] = [None] * len(texts)
+        for item in items if isinstance(items, list) else []:
+            index = item.get("index") if isinstance(item, dict) else None
+            if isinstance(index, int) and 0 <= index < len(texts) and results[index] is None:
+                parsed = self.parse(item)
+                if parsed is not None:
+                    # Guard against the model attributing one message's identifiers to another
+                    verdict, intel = parsed
+                    results[index] = verdict, scrub_identifiers(intel, texts[index])
+        return results
+
+    def parse(self, result: dict) -> Optional[Tuple[Tuple[bool, float, str], Dict[str, list]]]:
+        if not isinstance(result, dict):
+            return None
+
+        label = str(result.get("label", "")).upper()
+        if label not in LABELS:
+            return None
+
+        try:
+            confidence = float(result.get("confidence", 0.0))
+        except (TypeError, ValueError):
+            return None
+
+        intel = {}
+        for key in INTEL_KEYS:
+            values = result.get(key, [])
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                return None
+            intel[key] = values
+
+        is_scam = label in ["SCAM", "SUSPICIOUS"]
+        return (is_scam, confidence, label), intel
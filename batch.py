@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+
+# Before the component imports: the shared LLM gateway reads its config on import
+load_dotenv()
+
+from classifier import ScamClassifier
+from extractor import IntelligenceExtractor, ScanResult, scan
+from analyzer import FusedAnalyzer
+from llm import gateway
+from logs import get_logger
+from metrics import metrics
+
+log = get_logger("batch")
+
+# (text, heuristic verdict or None, local scan) for a message that needs the LLM
+Pending = Tuple[str, Optional[Tuple[bool, float, str]], ScanResult]
+
+
+def message_text(item: Any) -> str:
+    # Same field precedence as HoneypotRequest.get_message_text()
+    if isinstance(item, str):
+        return item
+    if not isinstance(item, dict):
+        return ""
+    message = item.get("message")
+    if isinstance(message, dict):
+        text = message.get("text") or message.get("content") or ""
+    else:
+        text = message if isinstance(message, str) else ""
+    return text or item.get("text") or item.get("input") or ""
+
+
+def parse_items(body: str, limit: Optional[int] = None) -> List[Tuple[str, str]]:
+    """
+    Accepts JSON lines (one message object or string per line) or a single
+    JSON array. Returns (id, text) pairs; ids default to the line number.
+    """
+    body = body.strip()
+    if body.startswith("["):
+        raw = json.loads(body)
+    else:
+        raw = []
+        for line in body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw.append(json.loads(line))
+            except ValueError:
+                # Plain text dumps: treat the line itself as the message
+                raw.append(line)
+
+    items = []
+    for i, item in enumerate(raw):
+        text = message_text(item)
+        if not text.strip():
+            continue
+        item_id = str(item.get("id", i)) if isinstance(item, dict) else str(i)
+        items.append((item_id, text))
+        if limit and len(items) >= limit:
+            break
+    return items
+
+
+class BatchProcessor:
+    """
+    Offline scoring of many messages: identical texts are analysed once,
+    clear-cut messages are decided locally, and the rest are packed several
+    to a request and run with bounded concurrency. Results are yielded as
+    each pack finishes, followed by a summary record with throughput.
+    """
+    def __init__(self, classifier: ScamClassifier, extractor: IntelligenceExtractor,
+                 analyzer: Optional[FusedAnalyzer] = None, concurrency: Optional[int] = None,
+                 pack_size: Optional[int] = None, pack_chars: Optional[int] = None):
+        self.classifier = classifier
+        self.extractor = extractor
+        self.analyzer = analyzer
+        self.concurrency = concurrency or int(os.getenv("BATCH_CONCURRENCY", "4"))
+        self.pack_size = pack_size or int(os.getenv("BATCH_PACK_SIZE", "8"))
+        self.pack_chars = pack_chars or int(os.getenv("BATCH_PACK_CHARS", "2000"))
+
+    async def process(self, items: Iterable[Tuple[str, str]]) -> AsyncIterator[Dict[str, Any]]:
+        started = time.perf_counter()
+        # Completed LLM requests, fallbacks included; in the API this also counts concurrent turns
+        requests_before = metrics.count("llm_requests", None)
+        by_text: Dict[str, List[str]] = {}
+        total = 0
+        for item_id, text in items:
+            by_text.setdefault(text, []).append(item_id)
+            total += 1
+
+        pending: List[Pending] = []
+        for text, ids in by_text.items():
+            verdict = self.classifier.heuristic.classify(text)
+            local = scan(text)
+            if verdict is not None and (not verdict[0] or local.coverage >= self.extractor.skip_coverage):
+                for record in self._records(ids, verdict, "heuristic", local.data if verdict[0] else {}):
+                    yield record
+            else:
+                pending.append((text, verdict, local))
+
+        packs = self._pack(pending)
+        done: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [asyncio.create_task(self._run_pack(pack, semaphore, done)) for pack in packs]
+        try:
+            for _ in packs:
+                for text, verdict, tier, intel in await done.get():
+                    for record in self._records(by_text[text], verdict, tier, intel):
+                        yield record
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        elapsed = time.perf_counter() - started
+        yield {"summary": {
+            "messages": total,
+            "unique": len(by_text),
+            "llmMessages": len(pending),
+            "llmRequests": metrics.count("llm_requests", None) - requests_before,
+            "seconds": round(elapsed, 3),
+            "messagesPerSecond": round(total / elapsed, 1) if elapsed > 0 else None,
+        }}
+
+    def _pack(self, pending: List[Pending]) -> List[List[Pending]]:
+        if not self.analyzer:
+            return [[p] for p in pending]
+        packs, current, chars = [], [], 0
+        for p in pending:
+            if current and (len(current) >= self.pack_size or chars + len(p[0]) > self.pack_chars):
+                packs.append(current)
+                current, chars = [], 0
+            current.append(p)
+            chars += len(p[0])
+        if current:
+            packs.append(current)
+        return packs
+
+    async def _run_pack(self, pack: List[Pending], semaphore: asyncio.Semaphore, done: asyncio.Queue):
+        async with semaphore:
+            try:
+                fused = await self.analyzer.analyze_many([p[0] for p in pack]) if self.analyzer else [None] * len(pack)
+                results = await asyncio.gather(*(self._resolve(p, f) for p, f in zip(pack, fused)))
+            except Exception as e:
+                log.error("Pack failed", messages=len(pack), error=repr(e))
+                results = [(p[0], p[1] or (False, 0.0, "SAFE"), "error", p[2].data) for p in pack]
+        done.put_nowait(results)
+
+    async def _resolve(self, pending: Pending, fused) -> Tuple[str, Tuple[bool, float, str], str, Dict[str, list]]:
+        text, verdict, local = pending
+        if fused is None and verdict is not None:
+            # The heuristic already decided; only extraction is missing
+            return text, verdict, "heuristic", await self.extractor.extract(text)
+        if fused is None:
+            # Malformed or missing from the packed answer: the two separate calls
+            llm_verdict, intel = await asyncio.gather(self.classifier._classify_llm(text), self.extractor.extract(text))
+        else:
+            llm_verdict, llm_intel = fused
+            intel = self.extractor.merge(local.data, llm_intel)
+        # A decisive heuristic verdict stands; the LLM was only needed for extraction
+        if verdict is not None:
+            return text, verdict, "heuristic", intel
+        return text, llm_verdict, "llm", intel if llm_verdict[0] else {}
+
+    def _records(self, ids: List[str], verdict: Tuple[bool, float, str], tier: str, intel: Dict[str, list]) -> List[Dict[str, Any]]:
+        is_scam, confidence, label = verdict
+        return [{
+            "id": item_id,
+            "isScam": is_scam,
+            "label": label,
+            "confidence": confidence,
+            "tier": tier,
+            "duplicates": len(ids) - 1,
+            "intelligence": intel,
+        } for item_id in ids]
+
+
+async def _main(args):
+    source = sys.stdin if args.input == "-" else open(args.input)
+    with source:
+        items = parse_items(source.read())
+
+    analyzer = None if args.no_pack else FusedAnalyzer()
+    processor = BatchProcessor(ScamClassifier(), IntelligenceExtractor(), analyzer, concurrency=args.concurrency)
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        async for record in processor.process(items):
+            out.write(json.dumps(record) + "\n")
+            if "summary" in record:
+                summary = record["summary"]
+                print(f"[Batch] {summary['messages']} messages ({summary['unique']} unique) in "
+                      f"{summary['seconds']}s = {summary['messagesPerSecond']} msg/s", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        await gateway.http_client.aclose()
+
+
+def main():
+    """Offline replay: python batch.py dump.jsonl -o results.jsonl"""
+    parser = argparse.ArgumentParser(description="Score and extract intelligence from a dump of scam messages.")
+    parser.add_argument("input", nargs="?", default="-", help="JSON lines (or a JSON array) of messages; - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="Where to write JSON lines results; - for stdout")
+    parser.add_argument("-c", "--concurrency", type=int, default=None, help="Concurrent LLM requests (BATCH_CONCURRENCY)")
+    parser.add_argument("--no-pack", action="store_true", help="One LLM request per message instead of packing")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
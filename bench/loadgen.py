@@ -0,0 +1,244 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import string
+import sys
+import time
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Optional
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.mock_llm import MockConfig, serve_in_thread
+
+# Multi-turn scripts in the shape scammers actually use: an opener, pressure,
+# then payment details. Placeholders get fresh values per session so the
+# result cache and extractor see realistic variety.
+CONVERSATIONS = [
+    [
+        "Dear customer, your {bank} account will be blocked today due to pending KYC.",
+        "Sir this is urgent, please update KYC immediately otherwise account is suspended.",
+        "Click this link to verify: https://{domain}/kyc/{token}",
+        "If link not working, pay Rs 10 verification fee to {upi}",
+        "Why delay? Call me on {phone} and share the OTP you received.",
+        "Last warning. Transfer to account {account} IFSC {ifsc} to avoid penalty.",
+    ],
+    [
+        "Congratulations! You have won Rs 25,00,000 in the KBC lucky draw.",
+        "To claim your prize you must pay processing charge of Rs 4999.",
+        "Send the amount on UPI {upi} and share screenshot.",
+        "Our manager number is {phone}, whatsapp him for the cheque.",
+        "Hurry, offer valid only till tonight. Deposit in {account} if UPI fails.",
+    ],
+    [
+        "Hello, I am calling from the courier office. A parcel in your name has illegal items.",
+        "The customs officer wants to speak to you, stay on the line.",
+        "To close the case you must pay a security deposit, it will be refunded.",
+        "Pay to this UPI {upi} or transfer to {account}.",
+        "Do not tell anyone, this is a confidential investigation. Call {phone}.",
+    ],
+    [
+        "Hi, are you looking for part time work from home? Earn 5000 daily.",
+        "Just like YouTube videos and get paid per task.",
+        "First task done! To withdraw earnings register at https://{domain}/join",
+        "Registration fee is only 500, send on {upi}",
+    ],
+]
+BANKS = ["SBI", "HDFC", "ICICI", "Axis", "PNB"]
+HANDLES = ["ybl", "okaxis", "paytm", "oksbi", "ibl"]
+
+
+def fill(template: str, values: Dict[str, str]) -> str:
+    return template.format(**values)
+
+
+def session_values(rng: random.Random) -> Dict[str, str]:
+    name = "".join(rng.choices(string.ascii_lowercase, k=7))
+    return {
+        "bank": rng.choice(BANKS),
+        "domain": f"{name}-verify.in",
+        "token": "".join(rng.choices(string.ascii_letters + string.digits, k=8)),
+        "upi": f"{name}{rng.randint(10, 99)}@{rng.choice(HANDLES)}",
+        "phone": f"+91 {rng.choice('6789')}{rng.randint(100000000, 999999999)}",
+        "account": str(rng.randint(10 ** 11, 10 ** 12 - 1)),
+        "ifsc": f"{rng.choice(BANKS).upper()[:4]:X<4}0{rng.randint(100000, 999999)}",
+    }
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))], 1)
+
+
+class LoadGenerator:
+    """
+    Drives /honeypot with concurrent multi-turn conversations. Turns within a
+    conversation are sequential, like a real scammer waiting for the reply;
+    conversations run side by side up to `concurrency`.
+    """
+    def __init__(self, client: httpx.AsyncClient, sessions: int, concurrency: int,
+                 api_key: Optional[str] = None, seed: int = 1):
+        self.client = client
+        self.sessions = sessions
+        self.concurrency = concurrency
+        self.headers = {"x-api-key": api_key} if api_key else {}
+        self.rng = random.Random(seed)
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.fallbacks = 0
+
+    async def run(self) -> float:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        run_id = f"{int(time.time())}-{self.rng.randint(0, 9999)}"
+        scripts = [(f"bench-{run_id}-{i}", self.rng.choice(CONVERSATIONS), session_values(self.rng))
+                   for i in range(self.sessions)]
+        started = time.perf_counter()
+        await asyncio.gather(*(self._conversation(semaphore, *script) for script in scripts))
+        return time.perf_counter() - started
+
+    async def _conversation(self, semaphore: asyncio.Semaphore, session_id: str, script: List[str], values: Dict[str, str]):
+        async with semaphore:
+            for template in script:
+                body = {"sessionId": session_id, "message": {"sender": "scammer", "text": fill(template, values)}}
+                started = time.perf_counter()
+                try:
+                    response = await self.client.post("/honeypot", json=body, headers=self.headers)
+                    reply = response.json().get("reply", "") if response.status_code == 200 else None
+                except (httpx.HTTPError, ValueError):
+                    reply = None
+                self.latencies.append((time.perf_counter() - started) * 1000)
+                if reply is None:
+                    self.errors += 1
+                elif reply == "I did not understand that.":
+                    self.fallbacks += 1
+
+
+async def llm_stats(llm_url: str) -> Dict[str, Any]:
+    async with httpx.AsyncClient(base_url=llm_url, timeout=5) as client:
+        return (await client.get("/stats")).json()
+
+
+def delta(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+    return {k: v - before.get(k, 0) for k, v in after.items()}
+
+
+async def _main(args) -> Dict[str, Any]:
+    llm_url = args.llm_url
+    backend_urls = []
+    if llm_url is None:
+        # The mock flags describe the first (preferred) backend; extra ones are healthy copies
+        config = MockConfig(args.latency_ms, args.dist, args.rate_limit, args.malformed, args.retry_after,
+                            unavailable=args.unavailable)
+        for i in range(max(1, args.backends)):
+            serve_in_thread(args.mock_port + i, config if i == 0 else MockConfig(args.latency_ms, args.dist))
+            backend_urls.append(f"http://127.0.0.1:{args.mock_port + i}")
+        llm_url = backend_urls[0]
+
+    async with AsyncExitStack() as stack:
+        memory_manager = None
+        if args.target:
+            client = httpx.AsyncClient(base_url=args.target, timeout=60)
+        else:
+            # In-process: point the service at the mock before its modules read config
+            os.environ["OPENAI_BASE_URL"] = f"{llm_url}/v1"
+            os.environ.setdefault("OPENAI_API_KEY", "bench")
+            if len(backend_urls) > 1:
+                os.environ["LLM_BACKENDS"] = json.dumps([{"name": f"mock{i}", "base_url": f"{url}/v1"}
+                                                         for i, url in enumerate(backend_urls)])
+            os.environ["GUVI_CALLBACK_URL"] = f"{llm_url}/callback"
+            os.environ["CALLBACK_SPOOL_DIR"] = ""
+            # Synthetic identifiers must not end up in the real index snapshot
+            os.environ["INTEL_INDEX_PATH"] = ""
+            import main
+            await stack.enter_async_context(main.lifespan(main.app))
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=60)
+            memory_manager = main.memory_manager
+        await stack.enter_async_context(client)
+
+        mocks = backend_urls or [llm_url]
+        before_llm = [await llm_stats(url) for url in mocks]
+        if memory_manager is not None:
+            main.metrics.reset()
+        before_memory = memory_manager.stats() if memory_manager else None
+        before_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        generator = LoadGenerator(client, args.sessions, args.concurrency, args.api_key or os.getenv("APP_API_KEY"), args.seed)
+        elapsed = await generator.run()
+
+        after_llm = [await llm_stats(url) for url in mocks]
+        turns = len(generator.latencies)
+        calls, errors, by_backend = {}, {}, []
+        for before, after in zip(before_llm, after_llm):
+            backend_calls = delta(before["calls"], after["calls"])
+            by_backend.append(sum(v for k, v in backend_calls.items() if k != "callback"))
+            for k, v in backend_calls.items():
+                calls[k] = calls.get(k, 0) + v
+            for k, v in delta(before["errors"], after["errors"]).items():
+                errors[k] = errors.get(k, 0) + v
+        llm_calls = sum(v for k, v in calls.items() if k != "callback")
+
+        report = {
+            "sessions": args.sessions,
+            "turns": turns,
+            "seconds": round(elapsed, 2),
+            "turnsPerSecond": round(turns / elapsed, 1) if elapsed > 0 else None,
+            "latencyMs": {p: percentile(generator.latencies, q) for p, q in (("p50", 50), ("p95", 95), ("p99", 99))},
+            "errors": generator.errors,
+            "fallbackReplies": generator.fallbacks,
+            "llmCallsPerTurn": round(llm_calls / turns, 2) if turns else None,
+            "llmCalls": calls,
+            "llmErrors": errors,
+        }
+        if len(mocks) > 1:
+            report["llmCallsByBackend"] = by_backend
+        if memory_manager is not None:
+            after_memory = memory_manager.stats()
+            report["memory"] = {
+                "sessions": after_memory["sessions"] - before_memory["sessions"],
+                "approxBytes": after_memory["approxBytes"] - before_memory["approxBytes"],
+                "bytesPerSession": (after_memory["approxBytes"] - before_memory["approxBytes"]) // max(1, args.sessions),
+                # ru_maxrss is KiB on Linux; a high-water mark, so it only grows
+                "maxRssGrowthKb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before_rss,
+            }
+            snapshot = main.metrics.snapshot()
+            report["stages"] = {stage: {k: v for k, v in h.items() if k != "count"} for stage, h in snapshot["latency"].items()}
+            report["rates"] = snapshot["rates"]
+        return report
+
+
+def main():
+    """python bench/loadgen.py --sessions 200 --concurrency 50 --latency-ms 400 --rate-limit 0.05"""
+    parser = argparse.ArgumentParser(description="Load-test /honeypot with multi-turn scam conversations.")
+    parser.add_argument("--sessions", type=int, default=50, help="Conversations to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="Conversations in flight at once")
+    parser.add_argument("--target", default=None, help="Base URL of a running service; default runs main.app in-process")
+    parser.add_argument("--llm-url", default=None, help="Base URL of an already running mock (bench/mock_llm.py)")
+    parser.add_argument("--api-key", default=None, help="x-api-key to send (defaults to APP_API_KEY)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the report to this file")
+    mock = parser.add_argument_group("mock LLM (when --llm-url is not given)")
+    mock.add_argument("--mock-port", type=int, default=8900)
+    mock.add_argument("--latency-ms", type=float, default=300)
+    mock.add_argument("--dist", choices=["fixed", "uniform", "exponential", "lognormal"], default="lognormal")
+    mock.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of LLM calls answered with 429")
+    mock.add_argument("--malformed", type=float, default=0.0, help="Fraction of JSON answers that are truncated")
+    mock.add_argument("--retry-after", type=float, default=1.0)
+    mock.add_argument("--unavailable", type=float, default=0.0, help="Fraction of LLM calls answered with 503")
+    mock.add_argument("--backends", type=int, default=1,
+                      help="Mocks to route across (consecutive ports); the flags above shape the first")
+    args = parser.parse_args()
+
+    report = asyncio.run(_main(args))
+    print(json.dumps(report, indent=2))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from typing import List, Optional
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
+
+# Local OpenAI-compatible chat-completions server for benchmarks. Latency,
+# 429s, 503s and malformed JSON are injectable so the service's fallbacks and
+# the gateway's backoff, failover and circuit breaking can be exercised
+# without spending provider quota. Run several to stand in for several backends.
+# /callback stands in for the evaluation endpoint; its status codes are
+# scriptable through `callback_statuses` (consumed in order, then 200).
+
+REPLIES = [
+    "Oh no, what happened to my account? I am very worried. Which bank are you calling from?",
+    "Sir I don't understand this KYC. My grandson normally helps me. Where do I send the money?",
+    "Okay okay, I want to fix it. Can you give me your UPI ID so I can pay the fee?",
+    "My phone is very slow. Can you tell me the account number again slowly?",
+    "I am trying but the app is asking many things. Is there a phone number I can call you on?",
+]
+UPI = re.compile(r'[\w.\-]+@[a-zA-Z]+')
+PHONE = re.compile(r'(?:\+91[\-\s]?)?[6-9]\d{9}')
+URL = re.compile(r'https?://\S+')
+
+
+class MockConfig:
+    def __init__(self, latency_ms: float = 300, jitter: str = "lognormal", rate_limit: float = 0.0,
+                 malformed: float = 0.0, retry_after: float = 1.0, scam_rate: float = 0.9, unavailable: float = 0.0,
+                 callback_statuses: Optional[List[int]] = None):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.malformed = malformed
+        self.retry_after = retry_after
+        self.scam_rate = scam_rate
+        self.unavailable = unavailable
+        self.callback_statuses = list(callback_statuses or [])
+
+    @classmethod
+    def from_env(cls) -> "MockConfig":
+        return cls(
+            latency_ms=float(os.getenv("MOCK_LATENCY_MS", "300")),
+            jitter=os.getenv("MOCK_LATENCY_DIST", "lognormal"),
+            rate_limit=float(os.getenv("MOCK_429_RATE", "0")),
+            malformed=float(os.getenv("MOCK_MALFORMED_RATE", "0")),
+            retry_after=float(os.getenv("MOCK_RETRY_AFTER", "1")),
+            scam_rate=float(os.getenv("MOCK_SCAM_RATE", "0.9")),
+            unavailable=float(os.getenv("MOCK_503_RATE", "0")),
+        )
+
+    def sample_latency(self) -> float:
+        mean = self.latency_ms / 1000.0
+        if self.jitter == "fixed":
+            return mean
+        if self.jitter == "uniform":
+            return random.uniform(0.5 * mean, 1.5 * mean)
+        if self.jitter == "exponential":
+            return random.expovariate(1.0 / mean) if mean > 0 else 0.0
+        # lognormal: most calls near the mean, a long tail like real providers
+        return mean * random.lognormvariate(-0.125, 0.5) if mean > 0 else 0.0
+
+
+def stage_of(body: dict) -> str:
+    system = body["messages"][0]["content"] if body.get("messages") else ""
+    if "summarize" in system:
+        return "summary"
+    if "cybersecurity" in system and "extractor" in system:
+        return "analyze"
+    if "cybersecurity" in system:
+        return "classify"
+    if "extractor" in system:
+        return "extract"
+    return "reply"
+
+
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    config = config or MockConfig.from_env()
+    app = FastAPI(title="Mock OpenAI-compatible LLM")
+    app.state.config = config
+    app.state.calls = Counter()
+    app.state.errors = Counter()
+    app.state.models = Counter()
+    app.state.callbacks = []
+
+    def content_for(stage: str, body: dict) -> str:
+        text = body["messages"][-1]["content"]
+        if random.random() < config.malformed and stage != "reply":
+            return '{"label": "SCAM", "confidence": '  # truncated JSON
+        label = "SCAM" if random.random() < config.scam_rate else "SAFE"
+        intel = {
+            "bankAccounts": [], "upiIds": UPI.findall(text), "phishingLinks": URL.findall(text),
+            "phoneNumbers": PHONE.findall(text), "suspiciousKeywords": ["urgent"] if "urgent" in text.lower() else [],
+        }
+        if stage == "classify":
+            return json.dumps({"label": label, "confidence": 0.92})
+        if stage == "extract":
+            return json.dumps(intel)
+        if stage == "analyze":
+            if '"results"' in text:
+                count = len(re.findall(r'^\s*\[\d+\]', text, re.M))
+                return json.dumps({"results": [{"index": i, "label": label, "confidence": 0.9, **intel} for i in range(count)]})
+            return json.dumps({"label": label, "confidence": 0.92, **intel})
+        if stage == "summary":
+            return "The caller claims to be from the bank and wants a fee paid over UPI."
+        return random.choice(REPLIES)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        try:
+            body = await request.json()
+        except ClientDisconnect:
+            return JSONResponse({}, status_code=499) # Caller gave up, e.g. the losing side of a hedge
+        stage = stage_of(body)
+        app.state.calls[stage] += 1
+        app.state.models[f"{stage}:{body.get('model')}"] += 1
+        await asyncio.sleep(config.sample_latency())
+
+        if random.random() < config.unavailable:
+            app.state.errors["503"] += 1
+            return JSONResponse({"error": {"message": "Service unavailable", "type": "server_error"}}, status_code=503)
+
+        if random.random() < config.rate_limit:
+            app.state.errors["429"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                status_code=429, headers={"retry-after": str(config.retry_after)},
+            )
+
+        content = content_for(stage, body)
+        usage = {"prompt_tokens": sum(len(m["content"]) for m in body["messages"]) // 4,
+                 "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if body.get("stream"):
+            async def chunks():
+                for word in content.split(" "):
+                    chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": body.get("model", "mock"),
+                             "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(0.01)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+
+        return {
+            "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": usage,
+        }
+
+    @app.post("/callback")
+    async def callback_sink(request: Request):
+        # Stand-in for the evaluation callback endpoint
+        app.state.calls["callback"] += 1
+        if config.callback_statuses:
+            status = config.callback_statuses.pop(0)
+            if status >= 300:
+                app.state.errors[str(status)] += 1
+                return JSONResponse({"status": "error"}, status_code=status)
+        app.state.callbacks.append(await request.json())
+        return {"status": "ok"}
+
+    @app.get("/callbacks")
+    async def callbacks():
+        # Payloads accepted by /callback, oldest first
+        return app.state.callbacks
+
+    @app.get("/stats")
+    async def stats():
+        return {"calls": dict(app.state.calls), "errors": dict(app.state.errors), "models": dict(app.state.models)}
+
+    @app.post("/reset")
+    async def reset():
+        app.state.calls.clear()
+        app.state.errors.clear()
+        app.state.models.clear()
+        app.state.callbacks.clear()
+        return {"status": "ok"}
+
+    @app.post("/config")
+    async def update_config(request: Request):
+        # Change behaviour mid-run, e.g. {"unavailable": 1.0} for an outage
+        for key, value in (await request.json()).items():
+            if hasattr(config, key):
+                setattr(config, key, value)
+        return vars(config)
+
+    return app
+
+
+def serve_in_thread(port: int, config: Optional[MockConfig] = None, timeout: float = 10.0) -> uvicorn.Server:
+    """
+    Starts the mock on 127.0.0.1:port in a daemon thread and waits until it
+    accepts requests. Raises RuntimeError if it can't start (e.g. port in use).
+    """
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not server.started:
+        # A failed bind ends the thread (uvicorn exits) without ever setting started
+        if not thread.is_alive() or server.should_exit or time.monotonic() > deadline:
+            server.should_exit = True
+            raise RuntimeError(f"Mock LLM server did not start on port {port}")
+        time.sleep(0.02)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat-completions server.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--dist", choices=["fixed", "uniform", "exponential", "lognormal"], default="lognormal")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of calls answered with 429")
+    parser.add_argument("--malformed", type=float, default=0.0, help="Fraction of JSON answers that are truncated")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--unavailable", type=float, default=0.0, help="Fraction of calls answered with 503")
+    args = parser.parse_args()
+    config = MockConfig(args.latency_ms, args.dist, args.rate_limit, args.malformed, args.retry_after,
+                        unavailable=args.unavailable)
+    uvicorn.run(create_app(config), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
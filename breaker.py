@@ -0,0 +1,91 @@
+import bisect
+import time
+from collections import deque
+from typing import List, Optional
+from logs import get_logger
+from metrics import metrics
+
+log = get_logger("breaker")
+
+
+class CircuitBreaker:
+    """
+    Per-backend health. `failures` connection errors, timeouts or 5xx in a
+    row open the circuit: the backend is skipped for `cooldown` seconds,
+    then one probe is let through (half-open). The probe's success closes
+    it again, its failure re-opens it for another cooldown.
+
+    allow() hands out a token per admitted call; only the probe's token
+    carries the half-open slot, so a late failure() or release() from some
+    other call can't free or re-open it.
+    """
+    def __init__(self, name: str, failures: int, cooldown: float):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened_at: Optional[float] = None
+        self._probe: Optional[object] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> Optional[object]:
+        """A token for the call, or None if the circuit won't take it."""
+        state = self.state
+        if state == "closed":
+            return object()
+        if state == "half-open" and self._probe is None:
+            self._probe = object()
+            return self._probe
+        return None
+
+    def success(self):
+        if self.opened_at is not None:
+            log.info("Circuit closed", backend=self.name)
+        self.consecutive = 0
+        self.opened_at = None
+        self._probe = None
+
+    def failure(self, token: object):
+        self.consecutive += 1
+        probe = token is not None and token is self._probe
+        if probe or (self.opened_at is None and self.consecutive >= self.failures):
+            if self.opened_at is None:
+                log.warning("Circuit opened", backend=self.name, failures=self.consecutive)
+            metrics.incr("llm_breaker_open", self.name)
+            self.opened_at = time.monotonic()
+        if probe:
+            self._probe = None
+
+    def release(self, token: object):
+        # Call ended without a verdict (cancelled, or lost a hedge race); only the probe holds anything
+        if token is not None and token is self._probe:
+            self._probe = None
+
+
+class LatencyWindow:
+    """The last `size` successful call latencies (seconds), kept sorted for percentiles."""
+    def __init__(self, size: int = 200):
+        self._recent: deque = deque(maxlen=size)
+        self._sorted: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    def add(self, seconds: float):
+        if len(self._recent) == self._recent.maxlen:
+            oldest = self._recent[0]
+            del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+        self._recent.append(seconds)
+        bisect.insort(self._sorted, seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._sorted:
+            return None
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
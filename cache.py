@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+IDENTIFIER_KEYS = ["bankAccounts", "upiIds", "phishingLinks", "phoneNumbers"]
+
+_URL = re.compile(r'(https?://|www\.)\S+', re.I)
+_UPI = re.compile(r'[\w.\-]+@[a-z]+', re.I)
+_DIGITS = re.compile(r'\d+')
+_SPACES = re.compile(r'\s+')
+_COMPACT = re.compile(r'[\s\-]+')
+
+
+def normalize(text: str) -> str:
+    """
+    Collapses a message to its template: case, whitespace, links, UPI handles
+    and numbers are masked so copies of one campaign share a cache key.
+    """
+    text = text.lower()
+    text = _URL.sub("<url>", text)
+    text = _UPI.sub("<upi>", text)
+    text = _DIGITS.sub("#", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def scrub_identifiers(data: Dict[str, list], text: str) -> Dict[str, list]:
+    """
+    Drops identifiers that do not literally occur in `text`. A cached result
+    may come from another session's copy of the template, and its UPI IDs or
+    phone numbers must never be attributed to this one.
+    """
+    compact = _COMPACT.sub("", text).lower()
+    scrubbed = dict(data)
+    for key in IDENTIFIER_KEYS:
+        scrubbed[key] = [v for v in data.get(key, []) if _COMPACT.sub("", str(v)).lower() in compact]
+    return scrubbed
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class ResultCache:
+    """
+    Content-addressed LRU cache with TTL and single-flight coalescing for
+    classifier/extractor LLM results.
+    """
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self.max_size = max_size if max_size is not None else int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("RESULT_CACHE_TTL", "3600"))
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def key(self, namespace: str, text: str) -> str:
+        digest = hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+        return f"{namespace}:{digest}"
+
+    async def get_or_compute(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Returns (value, fresh). `fresh` is True only for the caller whose
+        factory actually ran; cache hits and coalesced waiters get False.
+        Exceptions are passed to every waiter and never cached.
+        """
+        if self.max_size <= 0:
+            return await factory(), True
+
+        while True:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, False
+                del self._entries[key]
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                value = await asyncio.shield(inflight)
+            except _LeaderCancelled:
+                # The computing caller was cancelled (e.g. a discarded speculative
+                # stage); that says nothing about this caller, so try again
+                continue
+            self.coalesced += 1
+            return value, False
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await factory()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters still get it; silences "never retrieved"
+            raise
+        except BaseException:
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            self._store(key, value)
+            return value, True
+        finally:
+            self._inflight.pop(key, None)
+
+    def _store(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hitRate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Shared by every component so the same template is only analysed once
+result_cache = ResultCache()
@@ -1,39 +1,228 @@
-import requests
+import asyncio
+import hashlib
+import httpx
 import json
 import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from logs import get_logger
+from metrics import metrics
 
-GUVI_CALLBACK_URL = "https://hackathon.guvi.in/api/updateHoneyPotFinalResult"
+log = get_logger("callback")
 
-def send_guvi_callback(session_id: str, scam_detected: bool, total_messages: int, intelligence: dict, agent_notes: str = ""):
+GUVI_CALLBACK_URL = os.getenv("GUVI_CALLBACK_URL", "https://hackathon.guvi.in/api/updateHoneyPotFinalResult")
+
+def build_payload(session_id: str, scam_detected: bool, total_messages: int, intelligence: dict, agent_notes: str = "") -> dict:
+    # Construct Payload based on official docs
+    return {
+        "sessionId": session_id,
+        "scamDetected": scam_detected,
+        "totalMessagesExchanged": total_messages,
+        "extractedIntelligence": {
+            "bankAccounts": list(intelligence.get("bankAccounts", [])),
+            "upiIds": list(intelligence.get("upiIds", [])),
+            "phishingLinks": list(intelligence.get("phishingLinks", [])),
+            "phoneNumbers": list(intelligence.get("phoneNumbers", [])),
+            "suspiciousKeywords": list(intelligence.get("suspiciousKeywords", []))
+        },
+        "agentNotes": agent_notes or "Scam detected via LLM classifier."
+    }
+
+def _intel_digest(payload: dict) -> str:
+    intel = {k: sorted(v) for k, v in payload["extractedIntelligence"].items()}
+    return hashlib.sha256(json.dumps(intel, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class CallbackDispatcher:
     """
-    Sends the final extraction result to the evaluation endpoint.
-    Should be called asynchronously.
+    Async, coalescing sender for the evaluation callback.
+
+    Every scam turn submits the session's cumulative snapshot, but only the
+    latest one per session is kept. It goes out right away when the
+    intelligence changed since the last delivery, otherwise once the session
+    has been quiet for `debounce` seconds (each unchanged update restarts
+    the wait). Failed sends retry with exponential backoff, and anything still
+    undelivered is spooled to disk and picked up again on the next start.
     """
-    try:
-        # Construct Payload based on official docs
-        payload = {
-            "sessionId": session_id,
-            "scamDetected": scam_detected,
-            "totalMessagesExchanged": total_messages,
-            "extractedIntelligence": {
-                "bankAccounts": intelligence.get("bankAccounts", []),
-                "upiIds": intelligence.get("upiIds", []),
-                "phishingLinks": intelligence.get("phishingLinks", []),
-                "phoneNumbers": intelligence.get("phoneNumbers", []),
-                "suspiciousKeywords": intelligence.get("suspiciousKeywords", [])
-            },
-            "agentNotes": agent_notes or "Scam detected via LLM classifier."
+    def __init__(self, url: Optional[str] = None, debounce: Optional[float] = None,
+                 max_queue: Optional[int] = None, max_retries: Optional[int] = None,
+                 spool_dir: Optional[str] = None):
+        self.url = url or GUVI_CALLBACK_URL
+        self.debounce = debounce if debounce is not None else float(os.getenv("CALLBACK_DEBOUNCE", "2"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("CALLBACK_MAX_QUEUE", "10000"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("CALLBACK_MAX_RETRIES", "4"))
+        self.spool_dir = spool_dir if spool_dir is not None else os.getenv("CALLBACK_SPOOL_DIR", "callback_spool")
+        self.concurrency = int(os.getenv("CALLBACK_CONCURRENCY", "8"))
+
+        # session_id -> (payload, due_at)
+        self._pending: Dict[str, Tuple[dict, float]] = {}
+        # Last delivered intelligence per session, LRU-bounded like the session store;
+        # forgetting one only means that session's next update isn't debounced
+        self._sent_digest: "OrderedDict[str, str]" = OrderedDict()
+        self._max_digests = int(os.getenv("SESSION_MAX", "10000"))
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        # Single thread keeps spool writes and deletes for a session in order
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="callback-spool")
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    async def start(self):
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            timeout=httpx.Timeout(5.0),
+        )
+        self._wake = asyncio.Event()
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            for payload in await asyncio.get_running_loop().run_in_executor(self._io, self._spool_load):
+                self._pending[payload["sessionId"]] = (payload, time.monotonic())
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        # One last attempt for everything due; whatever fails stays spooled
+        due = list(self._pending.items())
+        self._pending.clear()
+        await asyncio.gather(*(self._deliver(sid, payload, retries=0) for sid, (payload, _) in due),
+                             *self._inflight.values(), return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+        self._io.shutdown(wait=True)
+
+    def submit(self, session_id: str, scam_detected: bool, total_messages: int, intelligence: dict, agent_notes: str = ""):
+        """Queues the latest snapshot for this session. Never blocks."""
+        payload = build_payload(session_id, scam_detected, total_messages, intelligence, agent_notes)
+        if session_id not in self._pending and len(self._pending) >= self.max_queue:
+            self.dropped += 1
+            log.warning("Callback queue full, dropping update", session=session_id, maxQueue=self.max_queue, sampled=True)
+            return
+
+        # Unchanged snapshots only move the message count; push them back rather than keep the earlier deadline
+        changed = _intel_digest(payload) != self._sent_digest.get(session_id)
+        due_at = time.monotonic() + (0 if changed else self.debounce)
+        self._pending[session_id] = (payload, due_at)
+        self._spool(session_id, payload)
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            due = [sid for sid, (_, due_at) in self._pending.items() if due_at <= now and sid not in self._inflight]
+            for sid in due[:max(0, self.concurrency - len(self._inflight))]:
+                payload, _ = self._pending.pop(sid)
+                task = asyncio.create_task(self._deliver(sid, payload))
+                self._inflight[sid] = task
+                task.add_done_callback(lambda _, sid=sid: self._on_done(sid))
+
+            waits = [due_at - now for sid, (_, due_at) in self._pending.items() if sid not in self._inflight]
+            timeout = max(0.01, min(waits)) if waits else None
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _on_done(self, session_id: str):
+        self._inflight.pop(session_id, None)
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _deliver(self, session_id: str, payload: dict, retries: Optional[int] = None):
+        retries = self.max_retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                with metrics.timer("callback"):
+                    response = await self._client.post(self.url, json=payload)
+                if response.status_code < 300:
+                    self.sent += 1
+                    self._remember_digest(session_id, _intel_digest(payload))
+                    if session_id not in self._pending:
+                        self._unspool(session_id)
+                    return
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    # Our payload is wrong; retrying won't change the answer
+                    log.error("Callback rejected", session=session_id, status=response.status_code, body=response.text[:200])
+                    self.failed += 1
+                    if session_id not in self._pending:
+                        self._unspool(session_id)
+                    return
+                log.warning("Callback failed", session=session_id, status=response.status_code, attempt=attempt + 1)
+            except httpx.HTTPError as e:
+                log.warning("Callback error", session=session_id, attempt=attempt + 1, error=repr(e))
+            metrics.incr("callback_errors", "callback")
+
+            if attempt < retries:
+                await asyncio.sleep(min(30.0, 0.5 * (2 ** attempt)) * random.uniform(1.0, 1.5))
+
+        # Left on disk; the next start picks it up
+        self.failed += 1
+
+    def _remember_digest(self, session_id: str, digest: str):
+        self._sent_digest[session_id] = digest
+        self._sent_digest.move_to_end(session_id)
+        while len(self._sent_digest) > self._max_digests:
+            self._sent_digest.popitem(last=False)
+
+    def _spool_path(self, session_id: str) -> str:
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.spool_dir, f"{name}.json")
+
+    def _spool(self, session_id: str, payload: dict):
+        if self.spool_dir:
+            self._io.submit(self._spool_write, self._spool_path(session_id), payload)
+
+    def _unspool(self, session_id: str):
+        if self.spool_dir:
+            self._io.submit(self._spool_remove, self._spool_path(session_id))
+
+    @staticmethod
+    def _spool_write(path: str, payload: dict):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _spool_remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _spool_load(self) -> list:
+        payloads = []
+        for name in os.listdir(self.spool_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, name)) as f:
+                    payloads.append(json.load(f))
+            except (OSError, ValueError) as e:
+                log.warning("Skipping unreadable spool file", file=name, error=repr(e))
+        return payloads
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": len(self._pending),
+            "inflight": len(self._inflight),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
         }
-        
-        print(f"[Callback] Sending data to GUVI: {json.dumps(payload)}")
-        
-        # Send Request (Fail safe)
-        response = requests.post(GUVI_CALLBACK_URL, json=payload, timeout=5)
-        
-        if response.status_code == 200:
-            print("[Callback] Success!")
-        else:
-             print(f"[Callback] Failed: {response.status_code} - {response.text}")
-
-    except Exception as e:
-        print(f"[Callback] Error sending callback: {e}")
@@ -1,73 +1,105 @@
 import os
 import json
-from openai import AsyncOpenAI
+from llm import gateway
 from typing import Tuple
+from heuristics import HeuristicClassifier
+from cache import result_cache
+from logs import get_logger
+from metrics import metrics
+
+log = get_logger("classifier")
 
 class ScamClassifier:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
-        self.base_url = os.getenv("OPENAI_BASE_URL") # Support for Groq/Local
         self.model = os.getenv("LLM_MODEL", "gpt-3.5-turbo") # Default to gpt-3.5
         
-        if self.base_url:
-            self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
-        else:
-            self.client = AsyncOpenAI(api_key=self.api_key)
+        # Shared pooled client; see llm.py
+        self.llm = gateway
+
+        # Local tier; decides clear-cut messages without an LLM round trip
+        self.heuristic = HeuristicClassifier()
 
     async def classify(self, text: str) -> Tuple[bool, float, str]:
         """
         Classifies the text as SCAM, SUSPICIOUS, or SAFE.
         Returns (is_scam, confidence_score, label).
         """
+        is_scam, confidence, label, _ = await self.classify_tiered(text)
+        return is_scam, confidence, label
+
+    async def classify_tiered(self, text: str) -> Tuple[bool, float, str, str]:
+        """
+        Same as classify() but also reports which tier decided
+        ("heuristic" or "llm").
+        """
+        verdict = self.heuristic.classify(text)
+        if verdict is not None:
+            is_scam, confidence, label = verdict
+            return is_scam, confidence, label, "heuristic"
+
+        is_scam, confidence, label = await self._classify_llm(text)
+        return is_scam, confidence, label, "llm"
+
+    async def _classify_llm(self, text: str) -> Tuple[bool, float, str]:
         try:
             if not self.api_key:
                 # Fail open or closed? Safe for now if no key.
                 return False, 0.0, "SAFE"
 
-            prompt = f"""
-            Analyze the following message and classify it into one of these categories:
-            1. SCAM (Phishing, Lottery, Urgent Money Request, Job Scam, etc.)
-            2. SUSPICIOUS (Unsolicited, vague requests, strange links)
-            3. SAFE (Normal conversation, greeting, relevant query)
+            # Template copies of the same campaign share one LLM call
+            with metrics.timer("classify"):
+                result, _ = await result_cache.get_or_compute(
+                    result_cache.key("classify", text),
+                    lambda: self._request_classification(text)
+                )
+            return result
+
+        except Exception as e:
+            log.warning("Classification failed, treating as SAFE", error=repr(e))
+            metrics.incr("fallbacks", "classify")
+            return False, 0.0, "SAFE"
 
-            Return a JSON object:
-            {{
-                "label": "SCAM" | "SUSPICIOUS" | "SAFE",
-                "confidence": 0.0 to 1.0
-            }}
+    async def _request_classification(self, text: str) -> Tuple[bool, float, str]:
+        prompt = f"""
+        Analyze the following message and classify it into one of these categories:
+        1. SCAM (Phishing, Lottery, Urgent Money Request, Job Scam, etc.)
+        2. SUSPICIOUS (Unsolicited, vague requests, strange links)
+        3. SAFE (Normal conversation, greeting, relevant query)
 
-            Message: "{text}"
-            """
+        Return a JSON object:
+        {{
+            "label": "SCAM" | "SUSPICIOUS" | "SAFE",
+            "confidence": 0.0 to 1.0
+        }}
 
-            response = await self.client.chat.completions.create(
-                model=self.model, 
-                messages=[
-                    {"role": "system", "content": "You are an expert cybersecurity AI. Output only valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0,
-                response_format={"type": "json_object"}
-            )
+        Message: "{text}"
+        """
 
-            content = response.choices[0].message.content
-            print(f"[Classifier] Raw content: {content}") # Debug print
-            
-            # Sanitize content if needed (sometimes it adds ```json ... ```)
-            if "```" in content:
-                content = content.replace("```json", "").replace("```", "")
-                
-            result = json.loads(content)
-            
-            label = result.get("label", "SAFE").upper()
-            confidence = result.get("confidence", 0.0)
+        response = await self.llm.chat(
+            "classify",
+            model=self.model, 
+            messages=[
+                {"role": "system", "content": "You are an expert cybersecurity AI. Output only valid JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0,
+            response_format={"type": "json_object"}
+        )
 
-            # Treat SCAM and SUSPICIOUS as honeypot activation triggers
-            is_scam = label in ["SCAM", "SUSPICIOUS"]
+        content = response.choices[0].message.content
+        log.debug("Raw classification", content=content)
+        
+        # Sanitize content if needed (sometimes it adds ```json ... ```)
+        if "```" in content:
+            content = content.replace("```json", "").replace("```", "")
             
-            return is_scam, confidence, label
+        result = json.loads(content)
+        
+        label = result.get("label", "SAFE").upper()
+        confidence = result.get("confidence", 0.0)
 
-        except Exception as e:
-            print(f"[Classifier] Error: {e}")
-            import traceback
-            traceback.print_exc()
-            return False, 0.0, "SAFE"
+        # Treat SCAM and SUSPICIOUS as honeypot activation triggers
+        is_scam = label in ["SCAM", "SUSPICIOUS"]
+        
+        return is_scam, confidence, label
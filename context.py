@@ -0,0 +1,174 @@
+import asyncio
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from llm import gateway
+from memory import MemoryManager, INTEL_KEYS
+from intel_index import normalize_identifier
+from logs import get_logger
+from metrics import metrics
+
+log = get_logger("context")
+
+_COMPACT = re.compile(r'[\s\-]+')
+_NUMBER = re.compile(r'\d[\d\s\-]*\d')
+# Matched on digits only: "+91 98765 43210" has to find the stored "+919876543210"
+DIGIT_KINDS = ("phoneNumbers", "bankAccounts")
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token plus per-message overhead; good enough for budgeting
+    return len(text) // 4 + 4
+
+
+class ContextManager:
+    """
+    Keeps reply prompts under a token budget.
+
+    Layout, most stable first so provider-side prompt caching can hit:
+      persona system prompt -> rolling summary of older turns -> pinned turns
+      that contain extracted identifiers -> recent turns verbatim -> new message.
+
+    The summary is refreshed incrementally in the background once enough
+    unsummarized older turns pile up; until then they are included verbatim
+    as far as the budget allows.
+    """
+    def __init__(self, memory_manager: MemoryManager, token_budget: Optional[int] = None,
+                 keep_recent: Optional[int] = None, summary_batch: Optional[int] = None):
+        self.memory = memory_manager
+        self.token_budget = token_budget if token_budget is not None else int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+        self.keep_recent = keep_recent if keep_recent is not None else int(os.getenv("CONTEXT_KEEP_RECENT", "6"))
+        self.summary_batch = summary_batch if summary_batch is not None else int(os.getenv("CONTEXT_SUMMARY_BATCH", "6"))
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        self.model = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+        self.llm = gateway
+
+        # session_id -> (summary text, last message folded into it); regenerable, so just bounded
+        self._summaries: "OrderedDict[str, Tuple[str, Tuple[str, str]]]" = OrderedDict()
+        self._max_summaries = int(os.getenv("SESSION_MAX", "10000"))
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    def build(self, session_id: str, system_prompt: str, history: List[Dict[str, str]], user_message: str) -> List[Dict[str, str]]:
+        summary, marker = self._summaries.get(session_id, ("", None))
+        recent = history[-self.keep_recent:] if self.keep_recent else []
+        older = history[:len(history) - len(recent)]
+
+        # Older turns after the summary marker haven't been folded in yet
+        unsummarized = older
+        if marker is not None:
+            for i in range(len(older) - 1, -1, -1):
+                if (older[i]["role"], older[i]["content"]) == marker:
+                    unsummarized = older[i + 1:]
+                    break
+
+        head = [{"role": "system", "content": system_prompt}]
+        if summary:
+            head.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        tail = [{"role": "user", "content": user_message}]
+
+        used = sum(estimate_tokens(m["content"]) for m in head + tail)
+        # Recent turns always go in, dropping the oldest of them only if the budget is tiny
+        while len(recent) > 2 and used + sum(estimate_tokens(m["content"]) for m in recent) > self.token_budget:
+            recent = recent[1:]
+        used += sum(estimate_tokens(m["content"]) for m in recent)
+
+        text_ids, digit_ids = self._identifiers(session_id)
+        keep = set()
+        for i, m in enumerate(older):
+            if (text_ids or digit_ids) and self._mentions(m["content"], text_ids, digit_ids):
+                cost = estimate_tokens(m["content"])
+                if used + cost <= self.token_budget:
+                    keep.add(i)
+                    used += cost
+
+        # Fill what's left with the newest not-yet-summarized turns
+        offset = len(older) - len(unsummarized)
+        for i in range(len(older) - 1, offset - 1, -1):
+            if i in keep:
+                continue
+            cost = estimate_tokens(older[i]["content"])
+            if used + cost > self.token_budget:
+                break
+            keep.add(i)
+            used += cost
+
+        middle = [older[i] for i in sorted(keep)]
+
+        if len(unsummarized) >= self.summary_batch:
+            self._schedule_refresh(session_id, summary, unsummarized)
+
+        return head + middle + recent + tail
+
+    @staticmethod
+    def _mentions(content: str, text_ids: List[str], digit_ids: List[str]) -> bool:
+        if text_ids:
+            compact = _COMPACT.sub("", content).lower()
+            if any(v in compact for v in text_ids):
+                return True
+        if digit_ids:
+            # Each number as written, separators dropped, so digits of different numbers never join up
+            numbers = [_COMPACT.sub("", n) for n in _NUMBER.findall(content)]
+            return any(v in n for n in numbers for v in digit_ids)
+        return False
+
+    def _identifiers(self, session_id: str) -> Tuple[List[str], List[str]]:
+        """Extracted identifiers normalized for matching: (compacted lowercase, digits only)."""
+        extracted = self.memory.get_extracted(session_id)
+        text_ids, digit_ids = [], []
+        for k in INTEL_KEYS:
+            if k == "suspiciousKeywords":
+                continue
+            for v in extracted.get(k, []):
+                value = normalize_identifier(k, str(v))
+                if k in DIGIT_KINDS:
+                    digit_ids.append(value)
+                else:
+                    text_ids.append(_COMPACT.sub("", value))
+        return [v for v in text_ids if v], [v for v in digit_ids if v]
+
+    def _schedule_refresh(self, session_id: str, summary: str, turns: List[Dict[str, str]]):
+        if not self.api_key or session_id in self._refreshing:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._refresh(session_id, summary, list(turns)))
+        except RuntimeError:
+            return # No loop (sync caller); try again next turn
+        self._refreshing[session_id] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(session_id, None))
+
+    async def _refresh(self, session_id: str, summary: str, turns: List[Dict[str, str]]):
+        transcript = "\n".join(f"{'Scammer' if m['role'] == 'user' else 'You'}: {m['content']}" for m in turns)
+        prompt = (
+            f"Current summary: {summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}\n\n"
+            "Update the summary of this conversation in under 80 words. Keep every name, amount, "
+            "UPI ID, account number, phone number and link exactly as written, and what the other "
+            "person asked you to do."
+        )
+        try:
+            response = await self.llm.chat(
+                "summary",
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "You summarize chat transcripts accurately and briefly."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0,
+                max_tokens=160
+            )
+            new_summary = (response.choices[0].message.content or "").strip()
+        except Exception as e:
+            log.warning("Summary refresh failed", session=session_id, error=repr(e))
+            metrics.incr("fallbacks", "summary")
+            return
+
+        if new_summary:
+            last = turns[-1]
+            self._summaries[session_id] = (new_summary, (last["role"], last["content"]))
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self._max_summaries:
+                self._summaries.popitem(last=False)
+
+    def forget(self, session_id: str):
+        self._summaries.pop(session_id, None)
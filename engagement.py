@@ -0,0 +1,84 @@
+import os
+from typing import Optional, Tuple
+from memory import MemoryManager, Engagement
+from metrics import metrics
+
+Verdict = Tuple[bool, float, str]
+
+
+class EngagementTracker:
+    """
+    Sticky per-session classification, so a conversation that is clearly a
+    scam isn't re-classified on every turn.
+
+      unengaged --(scam verdict >= threshold)--> engaged
+      engaged: classification is skipped; a re-check runs every
+               `recheck_turns` turns, or on the very next turn after a
+               confident SAFE (a strike)
+      engaged --(`release_strikes` confident SAFE re-checks in a row)--> unengaged
+
+    A re-check that fails or times out comes back as SAFE with confidence 0
+    and is not a strike, so a classifier outage never drops an engagement.
+    """
+    def __init__(self, memory_manager: MemoryManager, threshold: Optional[float] = None,
+                 recheck_turns: Optional[int] = None, release_strikes: Optional[int] = None):
+        self.memory = memory_manager
+        self.threshold = threshold if threshold is not None else float(os.getenv("ENGAGE_THRESHOLD", "0.8"))
+        self.recheck_turns = recheck_turns if recheck_turns is not None else int(os.getenv("ENGAGE_RECHECK_TURNS", "5"))
+        self.release_strikes = release_strikes if release_strikes is not None else int(os.getenv("ENGAGE_RELEASE_STRIKES", "2"))
+
+    def get(self, session_id: str) -> Optional[Engagement]:
+        return self.memory.get_engagement(session_id)
+
+    def due(self, engagement: Engagement) -> bool:
+        # recheck_turns=0 disables scheduled re-checks
+        if engagement.strikes:
+            return True
+        return bool(self.recheck_turns) and engagement.since_check >= self.recheck_turns
+
+    def skip(self, session_id: str, engagement: Engagement) -> Verdict:
+        """Counts a turn answered without classification and returns the sticky verdict."""
+        engagement.since_check += 1
+        self.memory.set_engagement(session_id, engagement)
+        metrics.incr("classify_skipped", "engaged")
+        return True, engagement.confidence, engagement.label
+
+    def observe(self, session_id: str, verdict: Verdict) -> Optional[Engagement]:
+        """
+        Applies a fresh classifier verdict and returns the session's engagement
+        afterwards (None if not engaged).
+        """
+        is_scam, confidence, label = verdict
+        try:
+            confidence = float(confidence)
+        except (TypeError, ValueError):
+            confidence = 0.0
+        engagement = self.get(session_id)
+
+        if is_scam:
+            if engagement is None:
+                if confidence < self.threshold:
+                    return None
+                engagement = Engagement(label, confidence)
+                metrics.incr("engagements", "started")
+            else:
+                # Any scam verdict confirms; the sticky label tracks the strongest one
+                if confidence >= engagement.confidence:
+                    engagement.label, engagement.confidence = label, confidence
+                engagement.since_check = 0
+                engagement.strikes = 0
+            self.memory.set_engagement(session_id, engagement)
+            return engagement
+
+        if engagement is None or confidence < self.threshold:
+            # Not engaged, or a weak/failed SAFE that shouldn't move an engagement
+            return engagement
+
+        engagement.strikes += 1
+        engagement.since_check = 0
+        if engagement.strikes >= self.release_strikes:
+            metrics.incr("engagements", "released")
+            self.memory.set_engagement(session_id, None)
+            return None
+        self.memory.set_engagement(session_id, engagement)
+        return engagement
@@ -1,97 +1,228 @@
-import re
+import regex
 import json
 import os
-from typing import Dict, Any, Optional
-from openai import AsyncOpenAI
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
+from llm import gateway
+from cache import result_cache, scrub_identifiers
+from keywords import scam_keyword_matcher
+from logs import get_logger
+from metrics import metrics
+
+log = get_logger("extractor")
+
+# Every identifier type in one compiled alternation, so the text is scanned once.
+# Order matters: links before handles (URLs can contain '@'), handles before
+# emails, phones before generic digit runs.
+SCAN_PATTERN = regex.compile(r"""
+    (?P<url>(?:https?://|www\.)[^\s<>"']+)
+  | (?P<upi>[a-zA-Z0-9.\-_]{2,}@[a-zA-Z]{2,}(?![\w@])(?!\.[a-zA-Z]))
+  | (?P<email>[a-zA-Z0-9.\-_+]+@[a-zA-Z0-9\-]+(?:\.[a-zA-Z0-9\-]+)+)
+  | (?P<ifsc>\b[A-Z]{4}0[A-Z0-9]{6}\b)
+  | (?P<phone>(?<![\d+])(?:\+91[\-\s]?|0)?[6-9]\d{4}[\-\s]?\d{5}(?!\d))
+  | (?P<number>(?<!\d)\d{9,18}(?!\d))
+""", regex.VERBOSE)
+
+# Anything the LLM could still turn into an identifier
+CANDIDATE_PATTERN = regex.compile(r'\S*@\S+|https?://\S+|www\.\S+|\d[\d\-\s]{7,}\d', regex.IGNORECASE)
+IFSC_PATTERN = regex.compile(r'\b[A-Z]{4}0[A-Z0-9]{6}\b')
+# "91" + a mobile number written without the plus
+BARE_INTL_PHONE = regex.compile(r'91[6-9]\d{9}')
+ACCOUNT_CONTEXT = regex.compile(r'\b(a/?c|acc(?:ount)?|ifsc|bank|deposit|transfer)\b', regex.IGNORECASE)
+
+KNOWN_UPI_HANDLES = {
+    "ybl", "ibl", "axl", "paytm", "ptyes", "ptaxis", "pthdfc", "ptsbi", "upi", "apl", "yapl", "okaxis",
+    "oksbi", "okhdfcbank", "okicici", "icici", "sbi", "hdfcbank", "axisbank", "axisb", "kotak", "kmbl",
+    "yesbank", "yesbankltd", "pnb", "barodampay", "unionbank", "cnrb", "idfcbank", "idfcfirst", "indus",
+    "federal", "fbl", "rbl", "aubank", "jupiteraxis", "freecharge", "airtel", "jio", "postbank", "waaxis",
+    "wahdfcbank", "wasbi", "waicici", "slice", "fam", "amazonpay", "abfspay", "mobikwik", "ikwik",
+}
+URL_TRAILING = ".,;:!?)]}'\""
+INTEL_KEYS = ("bankAccounts", "upiIds", "phishingLinks", "phoneNumbers", "suspiciousKeywords")
+
+
+@dataclass
+class ScanResult:
+    data: Dict[str, list]
+    coverage: float
+
+
+def _normalize_phone(raw: str) -> str:
+    digits = regex.sub(r'\D', '', raw)
+    local = digits[-10:]
+    return f"+91{local}" if raw.startswith("+91") or len(digits) == 12 else local
+
+
+def scan(text: str) -> ScanResult:
+    """
+    Single-pass local extraction: identifiers from one compiled pattern,
+    keywords from the Aho-Corasick matcher. `coverage` is the share of
+    identifier-like spans that were resolved with confidence; anything short
+    of 1.0 means there is something the LLM might still make sense of.
+    """
+    data = {
+       "bankAccounts": [],
+       "upiIds": [],
+       "phishingLinks": [],
+       "phoneNumbers": [],
+       "suspiciousKeywords": []
+    }
+    resolved: List[Tuple[int, int]] = []
+    # An IFSC code anywhere means bare digit runs are almost certainly accounts
+    has_ifsc = IFSC_PATTERN.search(text) is not None
+
+    def account_context(start: int) -> bool:
+        return has_ifsc or ACCOUNT_CONTEXT.search(text, max(0, start - 40), start) is not None
+
+    for m in SCAN_PATTERN.finditer(text):
+        kind = m.lastgroup
+        value = m.group()
+        if kind == "url":
+            data["phishingLinks"].append(value.rstrip(URL_TRAILING))
+        elif kind == "upi":
+            data["upiIds"].append(value)
+            # Unknown handle suffixes are kept but left for the LLM to confirm
+            if value.rsplit("@", 1)[1].lower() not in KNOWN_UPI_HANDLES:
+                continue
+        elif kind == "email":
+            pass # Not intelligence we report, but nothing left to resolve either
+        elif kind == "ifsc":
+            pass
+        elif kind == "phone":
+            # A bare 10-digit run next to account words is an account number that looks like a mobile
+            if value.isdigit() and len(value) == 10 and account_context(m.start()):
+                data["bankAccounts"].append(value)
+            else:
+                data["phoneNumbers"].append(_normalize_phone(value))
+        elif kind == "number":
+            if account_context(m.start()):
+                data["bankAccounts"].append(value)
+            elif BARE_INTL_PHONE.fullmatch(value):
+                data["phoneNumbers"].append(f"+{value}")
+            elif len(value) != 10:
+                data["bankAccounts"].append(value)
+            else:
+                continue # 10 digits that are not a mobile number: ambiguous
+        resolved.append(m.span())
+
+    # Digit runs the main pattern split or skipped
+    if has_ifsc:
+        for m in regex.finditer(r'(?<!\d)\d{9,18}(?!\d)', text):
+            if m.group() not in data["bankAccounts"] and _normalize_phone(m.group()) not in data["phoneNumbers"]:
+                data["bankAccounts"].append(m.group())
+                resolved.append(m.span())
+
+    for key in ("bankAccounts", "upiIds", "phishingLinks", "phoneNumbers"):
+        data[key] = list(dict.fromkeys(data[key]))
+    data["suspiciousKeywords"] = sorted(scam_keyword_matcher.find(text))
+
+    candidates = [c.span() for c in CANDIDATE_PATTERN.finditer(text)]
+    if not candidates:
+        return ScanResult(data, 1.0)
+    covered = sum(1 for start, end in candidates if any(s < end and start < e for s, e in resolved))
+    return ScanResult(data, covered / len(candidates))
+
+
+def extract_regex(text: str) -> Dict[str, list]:
+    """
+    Pattern based extraction. Kept at module level so the classifier's
+    heuristic tier can reuse the same hits without an extractor instance.
+    """
+    return scan(text).data
+
 
 class IntelligenceExtractor:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
-        self.base_url = os.getenv("OPENAI_BASE_URL")
         self.model = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+        # Local coverage at or above this skips the LLM call (above 1.0 never skips)
+        self.skip_coverage = float(os.getenv("EXTRACT_SKIP_COVERAGE", "1.0"))
 
-        if self.base_url:
-            self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
-        else:
-            self.client = AsyncOpenAI(api_key=self.api_key)
+        # Shared pooled client; see llm.py
+        self.llm = gateway
 
     async def extract(self, text: str) -> Dict[str, Any]:
         """
         Combines Regex and LLM extraction to get structured intelligence lists.
         """
         # 1. Regex Extraction (Fast, precise for patterns)
-        regex_data = self._extract_regex(text)
+        with metrics.timer("extract-regex"):
+            local = scan(text)
+        regex_data = local.data
 
-        # 2. LLM Extraction (Smart, handles context/formatting)
-        llm_data = await self._extract_llm(text)
+        # 2. LLM Extraction (Smart, handles context/formatting), only when the
+        # local pass left something unresolved or found nothing at all
+        found_any = any(regex_data.values())
+        if found_any and local.coverage >= self.skip_coverage:
+            metrics.incr("extract_llm_skipped", "extract")
+            llm_data = {}
+        else:
+            llm_data = await self._extract_llm(text)
 
         # 3. Merge Strategies (Union of lists)
-        merged = {
+        return self.merge(regex_data, llm_data)
+
+    def merge(self, regex_data: Dict[str, list], llm_data: Dict[str, list]) -> Dict[str, list]:
+        return {
             "bankAccounts": list(set(regex_data.get("bankAccounts", []) + llm_data.get("bankAccounts", []))),
             "upiIds": list(set(regex_data.get("upiIds", []) + llm_data.get("upiIds", []))),
             "phishingLinks": list(set(regex_data.get("phishingLinks", []) + llm_data.get("phishingLinks", []))),
             "phoneNumbers": list(set(regex_data.get("phoneNumbers", []) + llm_data.get("phoneNumbers", []))),
-            "suspiciousKeywords": list(set(llm_data.get("suspiciousKeywords", []))) # LLM only for keywords
+            "suspiciousKeywords": list(set(regex_data.get("suspiciousKeywords", []) + llm_data.get("suspiciousKeywords", [])))
         }
-        return merged
 
     def _extract_regex(self, text: str) -> Dict[str, list]:
-        data = {
-           "bankAccounts": [],
-           "upiIds": [],
-           "phishingLinks": [],
-           "phoneNumbers": [],
-           "suspiciousKeywords": []
-        }
-
-        # UPI Pattern
-        upi_pattern = r'[a-zA-Z0-9.\-_]+@[a-zA-Z]+'
-        data['upiIds'] = re.findall(upi_pattern, text)
-
-        # Link Pattern
-        url_pattern = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+'
-        data['phishingLinks'] = re.findall(url_pattern, text)
-
-        # Phone Pattern (Indian +91 or 10 digits)
-        phone_pattern = r'(?:\+91[\-\s]?)?[6-9]\d{9}'
-        data['phoneNumbers'] = re.findall(phone_pattern, text)
-
-        # Bank Account (Simple 9-18 digits context) - Weak regex, relying more on LLM
-        # But we can try catching long number strings
-        bank_pattern = r'\b\d{9,18}\b'
-        possible_accounts = re.findall(bank_pattern, text)
-        # Filter out 10 digit numbers that look like phones
-        data['bankAccounts'] = [acc for acc in possible_accounts if len(acc) != 10]
-        
-        return data
+        return extract_regex(text)
 
     async def _extract_llm(self, text: str) -> Dict[str, list]:
         try:
             if not self.api_key:
                 return {}
-            
-            prompt = """
-            Extract scam intelligence from the message. 
-            Return a JSON object with keys: "bankAccounts", "upiIds", "phishingLinks", "phoneNumbers", "suspiciousKeywords".
-            Values must be LISTS of strings. Return empty list [] if nothing found.
-            
-            "suspiciousKeywords": specific urgent/scam words used (e.g. "blocked", "verify", "expire").
-            
-            Message: "{text}"
-            """
-            
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful data extractor. Output only valid JSON with lists."},
-                    {"role": "user", "content": prompt.format(text=text)}
-                ],
-                temperature=0,
-                response_format={"type": "json_object"}
-            )
-            
-            content = response.choices[0].message.content
-            return json.loads(content)
+
+            with metrics.timer("extract-llm"):
+                data, fresh = await result_cache.get_or_compute(
+                    result_cache.key("extract", text),
+                    lambda: self._request_extraction(text)
+                )
+            # Reused results come from another copy of the template; keep only
+            # identifiers that are actually in this message
+            return data if fresh else scrub_identifiers(data, text)
         except Exception as e:
-            print(f"Extraction Error: {e}")
+            log.warning("LLM extraction failed, using regex only", error=repr(e))
+            metrics.incr("fallbacks", "extract")
             return {"bankAccounts": [], "upiIds": [], "phishingLinks": [], "phoneNumbers": [], "suspiciousKeywords": []}
+
+    async def _request_extraction(self, text: str) -> Dict[str, list]:
+        prompt = """
+        Extract scam intelligence from the message. 
+        Return a JSON object with keys: "bankAccounts", "upiIds", "phishingLinks", "phoneNumbers", "suspiciousKeywords".
+        Values must be LISTS of strings. Return empty list [] if nothing found.
+        
+        "suspiciousKeywords": specific urgent/scam words used (e.g. "blocked", "verify", "expire").
+        
+        Message: "{text}"
+        """
+        
+        response = await self.llm.chat(
+            "extract",
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "You are a helpful data extractor. Output only valid JSON with lists."},
+                {"role": "user", "content": prompt.format(text=text)}
+            ],
+            temperature=0,
+            response_format={"type": "json_object"}
+        )
+        
+        content = response.choices[0].message.content
+        result = json.loads(content)
+        # Raised before the result cache stores it, so a bad shape isn't served to the whole template
+        if not isinstance(result, dict):
+            raise ValueError(f"extraction is not an object: {type(result).__name__}")
+        data = {}
+        for key in INTEL_KEYS:
+            values = result.get(key, [])
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise ValueError(f"extraction field {key!r} is not a list of strings")
+            data[key] = values
+        return data
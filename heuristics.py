@@ -0,0 +1,97 @@
+import os
+import re
+from typing import Dict, Optional, Tuple
+from extractor import extract_regex
+from keywords import scam_keyword_matcher
+from metrics import metrics
+
+# Weights for the shared scam keyword list (keywords.SCAM_KEYWORDS), grouped so
+# that near-duplicates ("blocked", "account blocked") count once. Weights are
+# additive across groups and the total is clamped to [0, 1], so a couple of
+# strong hits (or one hit plus a payment identifier) crosses the SCAM threshold.
+KEYWORD_GROUPS = {
+    "threat": (0.3, ("account blocked", "account suspended", "account will be blocked", "blocked", "suspended",
+                "deactivated", "frozen", "expire", "expired", "expiring", "final notice")),
+    "kyc": (0.35, ("kyc", "update kyc", "kyc pending", "pan card", "aadhaar", "aadhar")),
+    "credentials": (0.35, ("otp", "share otp", "cvv", "pin", "password")),
+    "prize": (0.35, ("lottery", "prize", "winner", "you have won", "jackpot", "lucky draw", "reward", "cashback", "gift")),
+    "urgency": (0.25, ("urgent", "urgently", "immediately", "act now", "last chance", "limited time")),
+    "verify": (0.2, ("verify", "verification", "confirm your details", "update your details")),
+    "fee": (0.3, ("refund", "processing fee", "registration fee", "advance fee", "penalty", "fine")),
+    "link": (0.2, ("click the link", "click here")),
+    "remote": (0.35, ("download the app", "anydesk", "teamviewer", "screen share")),
+    "job": (0.3, ("work from home", "part time job", "daily income")),
+    "investment": (0.35, ("investment", "double your money", "crypto")),
+    "parcel": (0.3, ("customs", "parcel", "courier", "fedex")),
+    "authority": (0.35, ("police", "arrest", "cbi", "digital arrest")),
+    "utility": (0.35, ("electricity disconnected", "power cut", "bill overdue")),
+    "impersonation": (0.2, ("customer care", "bank officer", "rbi", "sbi", "loan approved")),
+    "cards": (0.1, ("credit card", "debit card")),
+}
+# Keywords added to the shared list later without a group of their own
+DEFAULT_KEYWORD_WEIGHT = 0.25
+KEYWORD_WEIGHTS = {kw: (group, weight) for group, (weight, kws) in KEYWORD_GROUPS.items() for kw in kws}
+
+# Shapes a fixed keyword list can't express, scored into the same groups
+SCAM_PATTERNS = [
+    (re.compile(r'\bwithin\s+\d+\s*(hours?|hrs|minutes?|mins)\b', re.I), "urgency", 0.25),
+    (re.compile(r'\b(pay|send|transfer|deposit)\b.{0,30}\b(rs\.?|inr|₹|rupees|amount|money|charges?)', re.I), "payment", 0.3),
+    (re.compile(r'\bearn\s+(rs\.?\s*|₹\s*)?\d+', re.I), "job", 0.3),
+    (re.compile(r'\b(electricity|power)\b.{0,40}\b(disconnect(ed)?|cut)\b', re.I), "utility", 0.35),
+    (re.compile(r'\b(bank|account|a/c|card)\b', re.I), "banking", 0.1),
+    (re.compile(r'\b(click|tap)\b.{0,20}\b(link|here)\b', re.I), "link", 0.2),
+]
+
+# Identifier hits from the extractor's regex pass.
+IDENTIFIER_WEIGHTS = {
+    "upiIds": 0.35,
+    "phishingLinks": 0.25,
+    "bankAccounts": 0.2,
+    "phoneNumbers": 0.15,
+}
+
+
+class HeuristicClassifier:
+    """
+    Cheap local scoring in front of the LLM classifier. Returns a verdict only
+    when it is decisive: a high score is SCAM, but a low score on its own is
+    just missing evidence. SAFE also needs the message to be short small talk
+    ("ok", "who is this?"); anything longer without signals goes to the LLM.
+    """
+    def __init__(self, scam_threshold: Optional[float] = None, safe_threshold: Optional[float] = None,
+                 safe_max_words: Optional[int] = None):
+        self.scam_threshold = scam_threshold if scam_threshold is not None else float(os.getenv("HEURISTIC_SCAM_THRESHOLD", "0.8"))
+        self.safe_threshold = safe_threshold if safe_threshold is not None else float(os.getenv("HEURISTIC_SAFE_THRESHOLD", "0.05"))
+        self.safe_max_words = safe_max_words if safe_max_words is not None else int(os.getenv("HEURISTIC_SAFE_MAX_WORDS", "6"))
+
+    def score(self, text: str) -> float:
+        groups: Dict[str, float] = {}
+        for keyword in scam_keyword_matcher.find(text):
+            group, weight = KEYWORD_WEIGHTS.get(keyword, (keyword, DEFAULT_KEYWORD_WEIGHT))
+            groups[group] = max(weight, groups.get(group, 0.0))
+        for pattern, group, weight in SCAM_PATTERNS:
+            if pattern.search(text):
+                groups[group] = max(weight, groups.get(group, 0.0))
+        raw = sum(groups.values())
+
+        regex_data = extract_regex(text)
+        for key, weight in IDENTIFIER_WEIGHTS.items():
+            if regex_data.get(key):
+                raw += weight
+
+        return min(raw, 1.0)
+
+    def classify(self, text: str) -> Optional[Tuple[bool, float, str]]:
+        """
+        Returns (is_scam, confidence, label) when the score is decisive,
+        None when the message falls in the ambiguous band.
+        """
+        score = self.score(text)
+        if score >= self.scam_threshold:
+            metrics.incr("heuristic", "decided")
+            return True, round(score, 2), "SCAM"
+        if score <= self.safe_threshold and len(text.split()) <= self.safe_max_words:
+            metrics.incr("heuristic", "decided")
+            return False, round(1.0 - score, 2), "SAFE"
+        metrics.incr("heuristic", "ambiguous")
+        return None
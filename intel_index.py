@@ -0,0 +1,449 @@
+import asyncio
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from logs import get_logger
+
+log = get_logger("intel_index")
+
+# Identifier kinds worth correlating across sessions; keywords are not identifiers
+INDEXED_KINDS = ("upiIds", "bankAccounts", "phoneNumbers", "phishingLinks")
+# Largest n top() answers; also the size of each leaderboard
+MAX_TOP = 1000
+
+
+def normalize_identifier(kind: str, value: str) -> str:
+    value = value.strip()
+    if kind == "upiIds":
+        return value.lower()
+    if kind == "phoneNumbers":
+        # +91 98765 43210, 09876543210 and 9876543210 are the same phone
+        return "".join(c for c in value if c.isdigit())[-10:]
+    if kind == "bankAccounts":
+        return "".join(c for c in value if c.isdigit())
+    if kind == "phishingLinks":
+        parts = urlsplit(value if "://" in value else f"http://{value}")
+        host = parts.netloc.lower()
+        if host.startswith("www."):
+            host = host[4:]
+        return f"{host}{parts.path.rstrip('/')}" + (f"?{parts.query}" if parts.query else "")
+    return value
+
+
+class IndexEntry:
+    __slots__ = ("sessions", "session_count", "hits", "first_seen", "last_seen")
+
+    def __init__(self, now: float):
+        self.sessions: Dict[str, None] = {} # Ordered set of interned session IDs, oldest first
+        self.session_count = 0
+        self.hits = 0
+        self.first_seen = now
+        self.last_seen = now
+
+
+class Leaderboard:
+    """
+    The `size` keys with the highest score, kept up to date as scores grow.
+    Scores only ever increase, so once full a key can only enter by beating
+    the current minimum, and every key outside never scores above it.
+    """
+    __slots__ = ("size", "keys", "floor")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.keys: Dict[str, None] = {}
+        self.floor = 0 # Lower bound of the minimum score inside; refreshed lazily
+
+    def offer(self, key: str, score: int, score_of: Callable[[str], int]):
+        if key in self.keys:
+            return
+        if len(self.keys) < self.size:
+            self.keys[key] = None
+            return
+        if score <= self.floor:
+            return
+        weakest = min(self.keys, key=score_of)
+        self.floor = score_of(weakest)
+        if score > self.floor:
+            del self.keys[weakest]
+            self.keys[key] = None
+
+
+# (kind, key) -> [first_seen, last_seen, hits, {session_id: seen_at}] seen since the last sync
+Deltas = Dict[Tuple[str, str], list]
+
+
+class SQLiteIndexStore:
+    """
+    The index kept in the shared SQLite file, for several workers. Each worker
+    keeps its IntelIndex as a replica: sync() pushes what that worker added
+    since the last call and returns every identifier any worker changed since
+    then. Rows carry a sequence number assigned inside the write transaction,
+    so "changed since" never misses a concurrent writer.
+    """
+    def __init__(self, path: str, max_sessions: int, max_identifiers: int):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.max_identifiers = max_identifiers
+        self._seq = 0 # Highest sequence number this replica has seen
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS intel_identifiers ("
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " first_seen REAL NOT NULL,"
+            " last_seen REAL NOT NULL,"
+            " hits INTEGER NOT NULL,"
+            " session_count INTEGER NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS intel_identifiers_seq ON intel_identifiers (seq)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS intel_sessions ("
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " session_id TEXT NOT NULL,"
+            " seen_at REAL NOT NULL,"
+            " PRIMARY KEY (kind, key, session_id))"
+        )
+
+    def sync(self, deltas: Deltas) -> List[list]:
+        """Writes `deltas`, then returns changed rows in the snapshot row format."""
+        with self._lock:
+            if deltas:
+                self._push(deltas)
+            return self._pull()
+
+    def _push(self, deltas: Deltas):
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM intel_identifiers").fetchone()[0]
+            for (kind, key), (first_seen, last_seen, hits, sessions) in deltas.items():
+                conn.execute(
+                    "INSERT INTO intel_identifiers (kind, key, first_seen, last_seen, hits, session_count, seq) "
+                    "VALUES (?, ?, ?, ?, ?, 0, ?) ON CONFLICT(kind, key) DO UPDATE SET "
+                    "first_seen = MIN(first_seen, excluded.first_seen), last_seen = MAX(last_seen, excluded.last_seen), "
+                    "hits = hits + excluded.hits, seq = excluded.seq",
+                    (kind, key, first_seen, last_seen, hits, seq),
+                )
+                new = 0
+                for session_id, seen_at in sessions.items():
+                    inserted = conn.execute(
+                        "INSERT OR IGNORE INTO intel_sessions (kind, key, session_id, seen_at) VALUES (?, ?, ?, ?)",
+                        (kind, key, session_id, seen_at),
+                    ).rowcount
+                    if inserted:
+                        new += 1
+                    else:
+                        conn.execute("UPDATE intel_sessions SET seen_at = ? WHERE kind = ? AND key = ? AND session_id = ?",
+                                     (seen_at, kind, key, session_id))
+                if new:
+                    conn.execute("UPDATE intel_identifiers SET session_count = session_count + ? WHERE kind = ? AND key = ?",
+                                 (new, kind, key))
+                    conn.execute(
+                        "DELETE FROM intel_sessions WHERE kind = ? AND key = ? AND session_id NOT IN ("
+                        "SELECT session_id FROM intel_sessions WHERE kind = ? AND key = ? ORDER BY seen_at DESC LIMIT ?)",
+                        (kind, key, kind, key, self.max_sessions),
+                    )
+            total = conn.execute("SELECT COUNT(*) FROM intel_identifiers").fetchone()[0]
+            if total > self.max_identifiers:
+                # Same policy as IntelIndex._prune: the least recently seen tenth goes in one go
+                conn.execute(
+                    "DELETE FROM intel_identifiers WHERE rowid IN ("
+                    "SELECT rowid FROM intel_identifiers ORDER BY last_seen LIMIT ?)",
+                    (total - int(self.max_identifiers * 0.9),),
+                )
+                conn.execute(
+                    "DELETE FROM intel_sessions WHERE NOT EXISTS (SELECT 1 FROM intel_identifiers i "
+                    "WHERE i.kind = intel_sessions.kind AND i.key = intel_sessions.key)"
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _pull(self) -> List[list]:
+        # One read transaction, so the session lists match the rows
+        self._conn.execute("BEGIN")
+        try:
+            rows = self._conn.execute(
+                "SELECT kind, key, first_seen, last_seen, hits, session_count, seq FROM intel_identifiers WHERE seq > ?",
+                (self._seq,),
+            ).fetchall()
+            sessions: Dict[Tuple[str, str], List[str]] = {}
+            if rows:
+                for kind, key, session_id in self._conn.execute(
+                    "SELECT s.kind, s.key, s.session_id FROM intel_sessions s JOIN intel_identifiers i "
+                    "ON i.kind = s.kind AND i.key = s.key WHERE i.seq > ? ORDER BY s.seen_at",
+                    (self._seq,),
+                ):
+                    sessions.setdefault((kind, key), []).append(session_id)
+        finally:
+            self._conn.execute("COMMIT")
+        if not rows:
+            return []
+        self._seq = max(row[6] for row in rows)
+        return [[kind, key, first_seen, last_seen, hits, count, sessions.get((kind, key), [])]
+                for kind, key, first_seen, last_seen, hits, count, _ in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class IntelIndex:
+    """
+    Inverted index from normalized identifier to the sessions it showed up
+    in, fed from MemoryManager.update_extracted. Each identifier keeps
+    first/last seen, a hit count (turns it was extracted from) and up to
+    `max_sessions` of its most recent session IDs; session_count keeps
+    counting past that cap. Per-kind leaderboards keep top() independent of
+    the index size. Snapshotted to `path` periodically and on stop.
+
+    With a `store_path` (several workers), the index lives in that SQLite
+    file instead of a snapshot: this copy is a replica that pushes its
+    additions and pulls everyone else's every `sync_interval` seconds.
+    """
+    def __init__(self, path: Optional[str] = None, max_identifiers: Optional[int] = None,
+                 max_sessions: Optional[int] = None, snapshot_interval: Optional[float] = None,
+                 store_path: Optional[str] = None, sync_interval: Optional[float] = None):
+        self.max_identifiers = max_identifiers or int(os.getenv("INTEL_INDEX_MAX_IDENTIFIERS", "200000"))
+        self.max_sessions = max_sessions or int(os.getenv("INTEL_INDEX_MAX_SESSIONS", "100"))
+        self.store = SQLiteIndexStore(store_path, self.max_sessions, self.max_identifiers) if store_path else None
+        self.path = "" if self.store else path if path is not None else os.getenv("INTEL_INDEX_PATH", "intel_index.json")
+        self.snapshot_interval = snapshot_interval if snapshot_interval is not None else float(os.getenv("INTEL_INDEX_SNAPSHOT_INTERVAL", "30"))
+        self.sync_interval = sync_interval if sync_interval is not None else float(os.getenv("INTEL_INDEX_SYNC_INTERVAL", "2"))
+        self._deltas: Deltas = {}
+        self._entries: Dict[str, Dict[str, IndexEntry]] = {kind: {} for kind in INDEXED_KINDS}
+        self._leaders: Dict[tuple, Leaderboard] = {}
+        self._reset_leaders()
+        self._size = 0
+        self._version = 0
+        self._saved_version = 0
+        self._top_cache: Dict[tuple, tuple] = {} # (kind, by, n) -> (version, result)
+        self._task: Optional[asyncio.Task] = None
+        if self.path:
+            self.load()
+
+    def add(self, session_id: str, data: Dict[str, list]):
+        now = time.time()
+        session_id = sys.intern(session_id)
+        for kind in INDEXED_KINDS:
+            entries = self._entries[kind]
+            for value in data.get(kind) or ():
+                if not isinstance(value, str):
+                    continue
+                key = normalize_identifier(kind, value)
+                if not key:
+                    continue
+                entry = entries.get(key)
+                if entry is None:
+                    entry = entries[sys.intern(key)] = IndexEntry(now)
+                    self._size += 1
+                if self.store is not None:
+                    delta = self._deltas.get((kind, key))
+                    if delta is None:
+                        delta = self._deltas[kind, key] = [now, now, 0, {}]
+                    delta[1] = now
+                    delta[2] += 1
+                    delta[3][session_id] = now
+                entry.hits += 1
+                entry.last_seen = now
+                if session_id in entry.sessions:
+                    # Most recent at the end so the cap drops the oldest
+                    del entry.sessions[session_id]
+                else:
+                    entry.session_count += 1
+                entry.sessions[session_id] = None
+                if len(entry.sessions) > self.max_sessions:
+                    del entry.sessions[next(iter(entry.sessions))]
+                self._leaders[kind, "sessions"].offer(key, entry.session_count, lambda k: entries[k].session_count)
+                self._leaders[kind, "hits"].offer(key, entry.hits, lambda k: entries[k].hits)
+        self._version += 1
+        if self._size > self.max_identifiers:
+            self._prune()
+
+    def _reset_leaders(self):
+        self._leaders = {(kind, by): Leaderboard(MAX_TOP) for kind in INDEXED_KINDS for by in ("sessions", "hits")}
+
+    def _rebuild_leaders(self):
+        self._reset_leaders()
+        for kind, entries in self._entries.items():
+            for by in ("sessions", "hits"):
+                score = (lambda e: e.hits) if by == "hits" else (lambda e: e.session_count)
+                best = heapq.nlargest(MAX_TOP, entries, key=lambda k: score(entries[k]))
+                self._leaders[kind, by].keys = dict.fromkeys(best)
+
+    def _prune(self):
+        # Forget the least recently seen tenth in one go, so this runs rarely
+        drop = self._size - int(self.max_identifiers * 0.9)
+        oldest = heapq.nsmallest(drop, ((e.last_seen, kind, key) for kind, entries in self._entries.items()
+                                        for key, e in entries.items()))
+        for _, kind, key in oldest:
+            del self._entries[kind][key]
+        self._size -= len(oldest)
+        self._rebuild_leaders()
+
+    def lookup(self, value: str, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Entries for this identifier, under one kind or every kind it normalizes into."""
+        matches = []
+        for k in ([kind] if kind else INDEXED_KINDS):
+            entries = self._entries.get(k)
+            if entries is None:
+                continue
+            key = normalize_identifier(k, value)
+            entry = entries.get(key)
+            if entry is not None:
+                matches.append(self._describe(k, key, entry, sessions=True))
+        return matches
+
+    def top(self, n: int = 10, kind: Optional[str] = None, by: str = "sessions") -> List[Dict[str, Any]]:
+        """Most used identifiers (n <= MAX_TOP) by distinct sessions (campaign reach) or hits."""
+        cache_key = (kind, by, n)
+        cached = self._top_cache.get(cache_key)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+
+        score = (lambda e: e.hits) if by == "hits" else (lambda e: e.session_count)
+        kinds = [kind] if kind else INDEXED_KINDS
+        best = heapq.nlargest(min(n, MAX_TOP), ((score(self._entries[k][key]), self._entries[k][key].last_seen, k, key)
+                                                for k in kinds for key in self._leaders[k, by].keys))
+        result = [self._describe(k, key, self._entries[k][key]) for _, _, k, key in best]
+        if len(self._top_cache) > 64:
+            self._top_cache.clear()
+        self._top_cache[cache_key] = (self._version, result)
+        return result
+
+    def _describe(self, kind: str, key: str, entry: IndexEntry, sessions: bool = False) -> Dict[str, Any]:
+        described = {
+            "kind": kind,
+            "value": key,
+            "sessionCount": entry.session_count,
+            "hits": entry.hits,
+            "firstSeen": entry.first_seen,
+            "lastSeen": entry.last_seen,
+        }
+        if sessions:
+            described["sessions"] = list(entry.sessions)
+        return described
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "identifiers": self._size,
+            "byKind": {kind: len(entries) for kind, entries in self._entries.items()},
+            "unsaved": bool(self._deltas) if self.store else self._version != self._saved_version,
+        }
+
+    # --- Persistence ---
+
+    def _rows(self) -> List[list]:
+        return [[kind, key, e.first_seen, e.last_seen, e.hits, e.session_count, list(e.sessions)]
+                for kind, entries in self._entries.items() for key, e in entries.items()]
+
+    def _write(self, rows: List[list]):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": 1, "entries": rows}, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                rows = json.load(f)["entries"]
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Ignoring unreadable index snapshot", path=self.path, error=repr(e))
+            return
+        self._apply(rows)
+        self._rebuild_leaders()
+        log.info("Loaded intelligence index", identifiers=self._size)
+
+    def _apply(self, rows: List[list]):
+        # Rows replace whatever this copy had for the identifier
+        for kind, key, first_seen, last_seen, hits, session_count, sessions in rows:
+            entries = self._entries.get(kind)
+            if entries is None:
+                continue
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[sys.intern(key)] = IndexEntry(first_seen)
+                self._size += 1
+            entry.first_seen, entry.last_seen, entry.hits, entry.session_count = first_seen, last_seen, hits, session_count
+            entry.sessions = dict.fromkeys(sys.intern(s) for s in sessions)
+
+    async def sync(self):
+        """Pushes this worker's additions to the shared store and pulls everyone's changes."""
+        deltas, self._deltas = self._deltas, {}
+        try:
+            rows = await asyncio.get_running_loop().run_in_executor(None, self.store.sync, deltas)
+        except sqlite3.Error as e:
+            log.error("Index sync failed", path=self.store.path, error=repr(e))
+            # Put them back, merged with anything added meanwhile
+            for key, delta in deltas.items():
+                newer = self._deltas.get(key)
+                if newer is not None:
+                    delta = [delta[0], newer[1], delta[2] + newer[2], {**delta[3], **newer[3]}]
+                self._deltas[key] = delta
+            return
+        if not rows:
+            return
+        self._apply(rows)
+        for kind, key, *_ in rows:
+            entries = self._entries.get(kind)
+            if entries is not None and key in entries:
+                self._leaders[kind, "sessions"].offer(key, entries[key].session_count, lambda k: entries[k].session_count)
+                self._leaders[kind, "hits"].offer(key, entries[key].hits, lambda k: entries[k].hits)
+        self._version += 1
+        if self._size > self.max_identifiers:
+            self._prune()
+
+    async def save(self):
+        if not self.path or self._version == self._saved_version:
+            return
+        version = self._version
+        # Copied on the loop so the writer thread never sees the index mid-update
+        rows = self._rows()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, rows)
+            self._saved_version = version
+        except OSError as e:
+            log.error("Index snapshot failed", path=self.path, error=repr(e))
+
+    async def start(self):
+        if self.store is not None:
+            await self.sync() # Everything the other workers already know
+            if self.sync_interval > 0:
+                self._task = asyncio.create_task(self._run(self.sync_interval, self.sync))
+        elif self.path and self.snapshot_interval > 0:
+            self._task = asyncio.create_task(self._run(self.snapshot_interval, self.save))
+
+    @staticmethod
+    async def _run(interval: float, persist: Callable[[], Awaitable[None]]):
+        while True:
+            await asyncio.sleep(interval)
+            await persist()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.store is not None:
+            await self.sync()
+            await asyncio.get_running_loop().run_in_executor(None, self.store.close)
+        else:
+            await self.save()
@@ -0,0 +1,77 @@
+from collections import deque
+from typing import Dict, Iterable, List, Set
+
+# Curated from the scam messages we see most: account threats, KYC/OTP
+# phishing, lottery/refund bait, job scams and pressure phrases.
+SCAM_KEYWORDS = [
+    "account blocked", "account suspended", "account will be blocked", "blocked", "suspended",
+    "deactivated", "frozen", "expire", "expired", "expiring",
+    "kyc", "update kyc", "kyc pending", "pan card", "aadhaar", "aadhar",
+    "otp", "share otp", "cvv", "pin", "password",
+    "verify", "verification", "confirm your details", "update your details",
+    "urgent", "urgently", "immediately", "act now", "last chance", "limited time", "final notice",
+    "lottery", "prize", "winner", "you have won", "jackpot", "lucky draw", "reward", "cashback", "gift",
+    "refund", "processing fee", "registration fee", "advance fee", "penalty", "fine",
+    "click the link", "click here", "download the app", "anydesk", "teamviewer", "screen share",
+    "work from home", "part time job", "daily income", "investment", "double your money", "crypto",
+    "customs", "parcel", "courier", "fedex", "police", "arrest", "cbi", "digital arrest",
+    "electricity disconnected", "power cut", "bill overdue",
+    "customer care", "bank officer", "rbi", "sbi", "credit card", "debit card", "loan approved",
+]
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a fixed keyword list. One pass over the text
+    finds every keyword regardless of how many there are.
+    """
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+
+        for keyword in keywords:
+            keyword = keyword.lower()
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(keyword)
+
+        # Breadth-first fill of failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> Set[str]:
+        """Keywords that occur in `text` as whole words (case-insensitive)."""
+        text = text.lower()
+        found = set()
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for keyword in self._out[state]:
+                start = i - len(keyword) + 1
+                before = text[start - 1] if start > 0 else " "
+                after = text[i + 1] if i + 1 < len(text) else " "
+                if not before.isalnum() and not after.isalnum():
+                    found.add(keyword)
+        return found
+
+
+scam_keyword_matcher = KeywordMatcher(SCAM_KEYWORDS)
@@ -0,0 +1,513 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from breaker import CircuitBreaker, LatencyWindow
+from logs import get_logger
+from metrics import metrics
+
+log = get_logger("llm")
+
+# Lower number wins the next free slot. Reply generation keeps the scammer
+# talking, so it goes ahead of classification, which goes ahead of extraction.
+STAGE_PRIORITY = {
+    "reply": 0,
+    "classify": 1,
+    "analyze": 1,
+    "extract": 2,
+    "summary": 3,
+}
+DEFAULT_PRIORITY = 3
+
+
+class PrioritySemaphore:
+    """asyncio.Semaphore that hands freed slots to the lowest priority number first."""
+    def __init__(self, value: int):
+        self._value = value
+        # Only callers still waiting; a cancelled waiter takes its entry with it
+        self._waiters = []
+        self._seq = itertools.count()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int):
+        if self._value > 0 and not self.waiting:
+            self._value -= 1
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), fut)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release() # Slot was handed to us just as we got cancelled; pass it on
+            else:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self):
+        if self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            fut.set_result(None)
+            return
+        self._value += 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously. A limit of 0 disables it."""
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        if self.capacity <= 0:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, delta: float):
+        # Settle an estimate against actual usage; may go negative (debt)
+        if self.capacity > 0:
+            self._refill()
+            self.tokens -= delta
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Backend:
+    """
+    One OpenAI-compatible endpoint: its own client, Retry-After pause,
+    circuit breaker and per-stage latency windows. `models` maps a stage
+    (or "default") to the model to ask for; stages it has no entry for use
+    the model the caller passed (LLM_MODEL). `stages` limits which stages
+    are routed here at all (empty = every stage).
+    """
+    def __init__(self, name: str, base_url: Optional[str], api_key: Optional[str], http_client,
+                 models: Optional[Dict[str, str]] = None, stages: Optional[List[str]] = None,
+                 rpm: float = 0, tpm: float = 0, breaker_failures: int = 5, breaker_cooldown: float = 30):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.http_client = http_client
+        self.models = models or {}
+        self.stages = set(stages or ())
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.breaker = CircuitBreaker(name, breaker_failures, breaker_cooldown)
+        self.paused_until = 0.0
+        self.latency: Dict[str, LatencyWindow] = {}
+        self._client: Optional[AsyncOpenAI] = None
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        # Built lazily: the SDK refuses to construct without a key
+        if self._client is None:
+            # Retries are the gateway's, so the SDK must not retry on its own
+            client_kwargs = {"api_key": self.api_key, "http_client": self.http_client, "max_retries": 0}
+            if self.base_url:
+                client_kwargs["base_url"] = self.base_url
+            self._client = AsyncOpenAI(**client_kwargs)
+        return self._client
+
+    @client.setter
+    def client(self, value: AsyncOpenAI):
+        self._client = value
+
+    @property
+    def paused_for(self) -> float:
+        return max(0.0, self.paused_until - time.monotonic())
+
+    def serves(self, stage: str) -> bool:
+        return not self.stages or stage in self.stages
+
+    def available(self) -> bool:
+        """Not paused by Retry-After and not behind an open circuit (doesn't claim a half-open probe)."""
+        return self.paused_for <= 0 and self.breaker.state != "open"
+
+    def request(self, stage: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        model = self.models.get(stage) or self.models.get("default")
+        return {**kwargs, "model": model} if model else kwargs
+
+    def observe(self, stage: str, seconds: float):
+        window = self.latency.get(stage)
+        if window is None:
+            window = self.latency[stage] = LatencyWindow()
+        window.add(seconds)
+        metrics.observe(f"llm:{self.name}", seconds * 1000)
+
+    def hedge_delay(self, stage: str, percentile: float, min_samples: int) -> Optional[float]:
+        """How long to wait on this backend before hedging; None until there is enough history."""
+        window = self.latency.get(stage)
+        if window is None or len(window) < min_samples:
+            return None
+        return window.percentile(percentile)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "circuit": self.breaker.state,
+            "pausedFor": round(self.paused_for, 2),
+            "p50Ms": {stage: round(w.percentile(0.5) * 1000, 1) for stage, w in self.latency.items()},
+        }
+
+
+def load_backends(http_client) -> List[Backend]:
+    """
+    Backends from LLM_BACKENDS, a JSON list such as
+
+      [{"name": "groq", "base_url": "https://api.groq.com/openai/v1", "api_key_env": "GROQ_API_KEY",
+        "models": {"classify": "llama-3.1-8b-instant", "extract": "llama-3.1-8b-instant",
+                   "default": "llama-3.3-70b-versatile"}},
+       {"name": "local", "base_url": "http://127.0.0.1:8080/v1", "stages": ["classify", "extract"]}]
+
+    in order of preference. Without it, the single OPENAI_BASE_URL backend.
+    """
+    failures = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+    cooldown = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+    rpm = float(os.getenv("LLM_RPM", "0"))
+    tpm = float(os.getenv("LLM_TPM", "0"))
+    default_key = os.getenv("OPENAI_API_KEY")
+
+    raw = os.getenv("LLM_BACKENDS", "").strip()
+    if not raw:
+        return [Backend("default", os.getenv("OPENAI_BASE_URL"), default_key, http_client,
+                        rpm=rpm, tpm=tpm, breaker_failures=failures, breaker_cooldown=cooldown)]
+
+    backends = []
+    for i, spec in enumerate(json.loads(raw)):
+        api_key = os.getenv(spec["api_key_env"]) if spec.get("api_key_env") else spec.get("api_key")
+        backends.append(Backend(
+            spec.get("name") or f"backend{i}", spec.get("base_url"), api_key or default_key, http_client,
+            models=spec.get("models"), stages=spec.get("stages"),
+            rpm=float(spec.get("rpm", rpm)), tpm=float(spec.get("tpm", tpm)),
+            breaker_failures=failures, breaker_cooldown=cooldown,
+        ))
+    return backends
+
+
+class NoBackendAvailable(Exception):
+    """Every backend for the stage is behind an open circuit; callers use their fallbacks."""
+
+
+class LLMGateway:
+    """
+    One pooled HTTP client shared by every component, with a global
+    concurrency cap and per-stage priority, routing calls across one or more
+    OpenAI-compatible backends (LLM_BACKENDS). Each backend has its own
+    request/token per-minute buckets, Retry-After pause and circuit breaker.
+
+    A call goes to the first healthy backend that serves its stage. A failed
+    attempt fails over to the next one straight away, or backs off when
+    there is none. A call still running past its backend's
+    LLM_HEDGE_PERCENTILE latency for that stage is hedged: the same request
+    goes to the next healthy backend and whichever answers first wins.
+    """
+    def __init__(self):
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "2"))
+        self.backoff_base = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("LLM_BACKOFF_MAX", "10"))
+        # 0 disables hedging
+        self.hedge_percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+        self.hedge_min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        self.hedge_min_delay = float(os.getenv("LLM_HEDGE_MIN_MS", "100")) / 1000.0
+
+        max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60")),
+            ),
+            timeout=httpx.Timeout(float(os.getenv("LLM_TIMEOUT", "30")), connect=5.0),
+        )
+
+        self.semaphore = PrioritySemaphore(int(os.getenv("LLM_MAX_CONCURRENCY", "16")))
+        self.backends = load_backends(self.http_client)
+
+    async def chat(self, stage: str, **kwargs) -> Any:
+        """
+        chat.completions.create() through the shared limits. Raises the last
+        error once retries are exhausted, so callers keep their own fallbacks.
+        """
+        priority = STAGE_PRIORITY.get(stage, DEFAULT_PRIORITY)
+        estimate = self._estimate_tokens(kwargs)
+
+        attempt = 0
+        failed: Set[Backend] = set()
+        while True:
+            # A hedge rides on its primary's slot
+            async with self.semaphore.slot(priority):
+                try:
+                    return await self._hedged(stage, kwargs, estimate, failed)
+                except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+                    error = e
+                except Exception:
+                    metrics.incr("llm_errors", stage)
+                    raise
+
+            attempt = await self._backoff(stage, attempt, error, self._retry_delay(stage, error, failed))
+
+    async def chat_stream(self, stage: str, **kwargs) -> AsyncIterator[str]:
+        """
+        Streaming variant of chat(); yields content deltas as they arrive.
+        Retries and failover only happen before the first delta, after that
+        errors propagate. Streams are not hedged.
+        """
+        priority = STAGE_PRIORITY.get(stage, DEFAULT_PRIORITY)
+        estimate = self._estimate_tokens(kwargs)
+
+        attempt = 0
+        failed: Set[Backend] = set()
+        while True:
+            async with self.semaphore.slot(priority):
+                claim = self._claim(self._route(stage, failed))
+                if claim is None:
+                    metrics.incr("llm_errors", stage)
+                    raise NoBackendAvailable(stage)
+                backend, token = claim
+                started = False
+                try:
+                    await self._admit(backend, estimate)
+                    stream = await backend.client.chat.completions.create(stream=True, **backend.request(stage, kwargs))
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            started = True
+                            yield delta
+                    backend.breaker.success()
+                    metrics.incr("llm_requests", stage)
+                    metrics.incr("llm_backend_requests", backend.name)
+                    return
+                except RateLimitError as e:
+                    if started:
+                        raise
+                    self._rate_limited(backend, e)
+                    failed.add(backend)
+                    error = e
+                except (APIConnectionError, APITimeoutError, InternalServerError) as e:
+                    backend.breaker.failure(token)
+                    if started:
+                        raise
+                    failed.add(backend)
+                    error = e
+                finally:
+                    backend.breaker.release(token)
+
+            attempt = await self._backoff(stage, attempt, error, self._retry_delay(stage, error, failed))
+
+    # --- Routing ---
+
+    def _serving(self, stage: str) -> List[Backend]:
+        return [b for b in self.backends if b.serves(stage)] or self.backends
+
+    def _route(self, stage: str, failed: Set[Backend]) -> List[Backend]:
+        """
+        Backends worth trying, best first: preference order, but ones that
+        already failed this call or are paused go last. Open circuits are out.
+        """
+        usable = [b for b in self._serving(stage) if b.breaker.state != "open"]
+        return sorted(usable, key=lambda b: (b in failed, b.paused_for))
+
+    @staticmethod
+    def _claim(routes: List[Backend], skip: Optional[Backend] = None) -> Optional[Tuple[Backend, object]]:
+        # allow() hands out the single half-open probe, so only ask the one we will use
+        for backend in routes:
+            if backend is skip:
+                continue
+            token = backend.breaker.allow()
+            if token is not None:
+                return backend, token
+        return None
+
+    def _retry_delay(self, stage: str, error: Exception, failed: Set[Backend]) -> Optional[float]:
+        if any(b not in failed and b.available() for b in self._serving(stage)):
+            metrics.incr("llm_failovers", stage)
+            return 0.0 # Another backend can take it right away
+        if isinstance(error, RateLimitError):
+            return _retry_after(error)
+        return None
+
+    def _hedge_delay(self, backend: Backend, stage: str) -> Optional[float]:
+        if self.hedge_percentile <= 0:
+            return None
+        delay = backend.hedge_delay(stage, self.hedge_percentile, self.hedge_min_samples)
+        return None if delay is None else max(delay, self.hedge_min_delay)
+
+    async def _hedged(self, stage: str, kwargs: Dict[str, Any], estimate: int, failed: Set[Backend]) -> Any:
+        routes = self._route(stage, failed)
+        claim = self._claim(routes)
+        if claim is None:
+            raise NoBackendAvailable(stage)
+        primary, token = claim
+        delay = self._hedge_delay(primary, stage) if len(routes) > 1 else None
+        if delay is None:
+            try:
+                return await self._call(primary, token, stage, kwargs, estimate, failed)
+            finally:
+                primary.breaker.release(token)
+
+        started = time.monotonic()
+        first = self._spawn(primary, token, stage, kwargs, estimate, failed)
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            claim = self._claim([b for b in routes if b.available()], skip=primary)
+            if claim is None:
+                return await first
+            metrics.incr("llm_hedges", stage)
+            pending.add(self._spawn(*claim, stage, kwargs, estimate, failed))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            metrics.incr("llm_hedge_wins", stage)
+                            # Abandoned calls must still count, or the primary's percentile only
+                            # sees its fast calls and drifts down into hedging everything
+                            if not first.done():
+                                primary.observe(stage, time.monotonic() - started)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # The loser (or everything, if we were cancelled) is abandoned mid-request
+            for task in pending:
+                task.cancel()
+
+    def _spawn(self, backend: Backend, token: object, stage: str, kwargs: Dict[str, Any], estimate: int, failed: Set[Backend]) -> asyncio.Task:
+        task = asyncio.ensure_future(self._call(backend, token, stage, kwargs, estimate, failed))
+        # Released on completion rather than inside _call: a task cancelled before its first step never runs its body
+        task.add_done_callback(lambda _: backend.breaker.release(token))
+        return task
+
+    async def _call(self, backend: Backend, token: object, stage: str, kwargs: Dict[str, Any], estimate: int, failed: Set[Backend]) -> Any:
+        # The caller releases `token`: _hedged for direct calls, the done callback for spawned ones
+        try:
+            await self._admit(backend, estimate)
+            started = time.monotonic()
+            response = await backend.client.chat.completions.create(**backend.request(stage, kwargs))
+        except RateLimitError as e:
+            self._rate_limited(backend, e)
+            failed.add(backend)
+            raise
+        except (APIConnectionError, APITimeoutError, InternalServerError):
+            backend.breaker.failure(token)
+            failed.add(backend)
+            raise
+        else:
+            backend.breaker.success()
+
+        backend.observe(stage, time.monotonic() - started)
+        metrics.incr("llm_requests", stage)
+        metrics.incr("llm_backend_requests", backend.name)
+        usage = getattr(response, "usage", None)
+        if usage is not None and getattr(usage, "total_tokens", None):
+            backend.token_bucket.adjust(usage.total_tokens - estimate)
+            metrics.incr("llm_prompt_tokens", stage, usage.prompt_tokens or 0)
+            metrics.incr("llm_completion_tokens", stage, usage.completion_tokens or 0)
+        return response
+
+    async def _admit(self, backend: Backend, estimate: int):
+        pause = backend.paused_for
+        if pause > 0:
+            await asyncio.sleep(pause)
+        await backend.request_bucket.acquire(1)
+        await backend.token_bucket.acquire(estimate)
+
+    def _rate_limited(self, backend: Backend, error: RateLimitError):
+        delay = _retry_after(error)
+        if delay is not None:
+            # Provider told us when to come back; hold every call to it, not just this one
+            backend.paused_until = max(backend.paused_until, time.monotonic() + delay)
+
+    async def _backoff(self, stage: str, attempt: int, error: Exception, delay: Optional[float]) -> int:
+        if isinstance(error, RateLimitError):
+            metrics.incr("llm_rate_limited", stage)
+        if attempt >= self.max_retries:
+            metrics.incr("llm_errors", stage)
+            raise error
+        if delay is None:
+            delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        attempt += 1
+        metrics.incr("llm_retries", stage)
+        log.info("LLM retry", stage=stage, attempt=attempt, maxRetries=self.max_retries,
+                 delay=round(delay, 2), error=type(error).__name__, sampled=True)
+        await asyncio.sleep(delay * random.uniform(1.0, 1.5))
+        return attempt
+
+    def _estimate_tokens(self, kwargs: Dict[str, Any]) -> int:
+        # ~4 characters per token is close enough for budgeting
+        chars = sum(len(str(m.get("content", ""))) for m in kwargs.get("messages", []))
+        return chars // 4 + int(kwargs.get("max_tokens") or 256)
+
+    @property
+    def paused_for(self) -> float:
+        """Seconds until any backend accepts calls again after a provider-requested (Retry-After) pause."""
+        return min(b.paused_for for b in self.backends)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "waiting": self.semaphore.waiting,
+            "pausedFor": round(self.paused_for, 2),
+            "backends": [b.stats() for b in self.backends],
+        }
+
+
+# One pool for the whole process
+gateway = LLMGateway()
@@ -0,0 +1,110 @@
+import random
+import re
+import zlib
+from typing import Dict, List
+from persona import Persona, PersonaManager
+
+# Reactions to what the scammer just said, first match wins
+REACTIONS = [
+    (re.compile(r'\b(otp|pin|cvv|password)\b', re.I), [
+        "OTP? {relative} told me never to share that... but you are from the bank only, no?",
+        "Which OTP, there are so many messages on my phone. Wait, I am finding my glasses.",
+        "The OTP message came and went, I could not read it fully.",
+    ]),
+    (re.compile(r'https?://|www\.|\blink\b', re.I), [
+        "The link is not opening on my phone, it shows only a white screen.",
+        "I clicked the link but it is asking so many details, I am scared to fill wrong.",
+        "My phone says this site is not safe. Is there some other way?",
+    ]),
+    (re.compile(r'\b(any\s?desk|team\s?viewer|quick\s?support|download|install)\b', re.I), [
+        "Which app? Play Store is showing many with the same name.",
+        "The app is downloading very slowly, my internet is weak here.",
+    ]),
+    (re.compile(r'\b(kyc|blocked|suspend\w*|freez\w*|frozen|expir\w*|deactivat\w*)\b', re.I), [
+        "Blocked? But I used my account yesterday only. What should I do now?",
+        "Oh no, please don't block it, {relative} will be very angry with me.",
+        "I did the KYC last year also. Why again?",
+    ]),
+    (re.compile(r'\b(police|cbi|customs|court|arrest\w*|case|fir)\b', re.I), [
+        "Police? I have not done anything wrong, please help me sir.",
+        "I am very scared now. Tell me what to do, I will do it.",
+    ]),
+    (re.compile(r'\b(prize|lottery|won|winner|reward|cashback|refund)\b', re.I), [
+        "Really? I never win anything! How do I get the money?",
+        "This is very good news, {relative} will not believe it.",
+    ]),
+    (re.compile(r'(rs\.?|₹|inr)\s*\d|\b\d+\s*(rs|rupees)\b|\b(pay|fee|charges?|amount|transfer|deposit)\b', re.I), [
+        "Okay, I will pay, but I don't want to send to the wrong place.",
+        "That is a lot of money for me, but if it is needed I will manage.",
+    ]),
+]
+STALLS = [
+    "Sorry, I did not understand fully. Can you explain again slowly?",
+    "Okay okay, I am trying. Please wait one minute.",
+    "I am a bit confused, my phone is showing something else.",
+    "Yes, I am listening. What should I do next?",
+]
+# Asks for the scammer's own details, for whatever we don't have yet
+NUDGES = {
+    "upiIds": [
+        "Tell me your UPI ID, I will send from PhonePe, {relative} set it up for me.",
+        "Which UPI ID should I pay to? Please type it clearly.",
+        "Give me the UPI ID once more, I will write it down.",
+    ],
+    "bankAccounts": [
+        "UPI is not working for me. Can you give the account number and IFSC? I will go to the bank.",
+        "Should I do bank transfer instead? Send me the account number and IFSC code.",
+    ],
+    "phoneNumbers": [
+        "Can you give me a number to call you? Typing is very hard for me.",
+        "What is your phone number? If I get stuck I will call you.",
+    ],
+}
+# When we already have everything: keep them sending more
+RETRY_NUDGES = [
+    "It is showing payment failed. Do you have another UPI ID?",
+    "The bank says this account is not accepting. Is there some other account?",
+    "Money is not going. Can you send a different number or UPI to try?",
+]
+
+
+class LocalReplyGenerator:
+    """
+    Persona-aware replies without an LLM, for when the provider is
+    overloaded or failing: a reaction to the scammer's last message in the
+    persona's voice, maybe a persona aside, and a nudge for whichever
+    payment detail we still don't have. The choice is seeded per session
+    and turn (a retry gets the same reply) and avoids repeating recent
+    replies.
+    """
+    def __init__(self, persona_manager: PersonaManager, recent: int = 6):
+        self.persona = persona_manager
+        self.recent = recent
+
+    def reply(self, session_id: str, history: List[Dict[str, str]], extracted: Dict[str, list], user_message: str) -> str:
+        persona = self.persona.get_persona(session_id)
+        rng = random.Random(zlib.crc32(f"{session_id}:{len(history)}".encode("utf-8")))
+        said = " ".join(m["content"] for m in history[-self.recent * 2:] if m["role"] == "assistant")
+
+        options = STALLS
+        for pattern, reactions in REACTIONS:
+            if pattern.search(user_message):
+                options = reactions
+                break
+        parts = [self._pick(options, persona, rng, said)]
+
+        if persona.asides and rng.random() < 0.35:
+            aside = self._pick(persona.asides, persona, rng, said)
+            if aside not in said:
+                parts.insert(0, aside)
+
+        missing = [kind for kind in NUDGES if not extracted.get(kind)]
+        parts.append(self._pick(NUDGES[missing[0]] if missing else RETRY_NUDGES, persona, rng, said))
+        return " ".join(parts)
+
+    def _pick(self, options, persona: Persona, rng: random.Random, said: str) -> str:
+        rendered = [o.format(relative=persona.relative) for o in options]
+        fresh = [o for o in rendered if o not in said]
+        text = rng.choice(fresh or rendered)
+        # Capitalise the relative when a template starts with it
+        return text[0].upper() + text[1:]
@@ -0,0 +1,102 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Fraction of hot-path messages (logged with sampled=True) that are kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        stamp = time.strftime("%H:%M:%S", time.localtime(record.created))
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        line = f"{stamp} {record.levelname:<7} [{record.name}] {record.getMessage()} {fields}".rstrip()
+        return f"{line}\n{record.exc_text}" if record.exc_text else line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller: a full queue drops the record."""
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve args and tracebacks here, but leave the formatting to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """
+    log.warning("Callback failed", status=503, attempt=2) keeps the keyword
+    arguments as fields of the record. sampled=True keeps only LOG_SAMPLE_RATE
+    of those messages (the rate is recorded so counts can be scaled back up).
+    """
+    def log(self, level: int, msg: str, *args, sampled: bool = False, exc_info=None, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if sampled:
+            if random.random() >= LOG_SAMPLE_RATE:
+                return
+            fields["sampleRate"] = LOG_SAMPLE_RATE
+        self.logger.log(level, msg, *args, exc_info=exc_info, extra={"fields": fields})
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _setup():
+    global _listener
+    root = logging.getLogger("honeypot")
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    records: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root.addHandler(DroppingQueueHandler(records))
+
+    # Writes to stderr happen on the listener thread, off the event loop
+    _listener = logging.handlers.QueueListener(records, stream)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    if _listener is None:
+        _setup()
+    return StructuredLogger(logging.getLogger(f"honeypot.{name}"), {})
@@ -1,22 +1,58 @@
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException, Header
+from fastapi import FastAPI, Request, HTTPException, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel, Field
 from typing import Optional, Union, Dict, Any
 import uuid
 import os
 import json
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 APP_API_KEY = os.getenv("APP_API_KEY")
 
+# Uvicorn takes its worker count from this variable, but a bare --workers flag
+# doesn't set it, so workers must be requested through it for the app to know.
+# Several workers share sessions through SQLite (persona choice is already
+# stable across processes).
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+if WORKERS > 1:
+    os.environ.setdefault("SESSION_BACKEND", "sqlite")
+    os.environ.setdefault("SESSION_SHARED", "1")
+
 from memory import MemoryManager
+from storage import SQLiteBackend, make_backend
 from persona import PersonaManager
 from classifier import ScamClassifier
 from extractor import IntelligenceExtractor
 from agents import HoneypotAgent
-from callback import send_guvi_callback
+from analyzer import FusedAnalyzer
+from pipeline import TurnPipeline, TurnResult
+from cache import result_cache
+from llm import gateway
+from callback import CallbackDispatcher
+from batch import BatchProcessor, parse_items
+from turns import TurnCoordinator
+from engagement import EngagementTracker
+from intel_index import IntelIndex, INDEXED_KINDS, MAX_TOP
+from logs import get_logger, DroppingQueueHandler
+from metrics import metrics
+from admission import AdmissionController, PRIORITY_INTEL, PRIORITY_ENGAGED, PRIORITY_NEW
+
+log = get_logger("api")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await callback_dispatcher.start()
+    await intel_index.start()
+    yield
+    await callback_dispatcher.stop()
+    await intel_index.stop()
+    await gateway.http_client.aclose()
+    memory_manager.close()
 
-app = FastAPI(title="Agentic Honey-Pot API", description="AI-powered scam detection and intelligence extraction API.")
+app = FastAPI(title="Agentic Honey-Pot API", description="AI-powered scam detection and intelligence extraction API.", lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -29,11 +65,41 @@ app.add_middleware(
 )
 
 # Initialize Components
-memory_manager = MemoryManager()
+session_backend = make_backend()
+if WORKERS > 1 and isinstance(session_backend, SQLiteBackend):
+    # Workers would overwrite each other's snapshot file; the index goes in the shared database instead
+    intel_index = IntelIndex(store_path=session_backend.path)
+else:
+    intel_index = IntelIndex(path="" if WORKERS > 1 else None)
+memory_manager = MemoryManager(backend=session_backend, index=intel_index)
+if WORKERS > 1 and not memory_manager.shared:
+    log.warning("Several workers without a shared session backend; a conversation may lose its history "
+                "when its turns land on different workers", workers=WORKERS, backend=os.getenv("SESSION_BACKEND"))
 persona_manager = PersonaManager()
 classifier = ScamClassifier()
 extractor = IntelligenceExtractor()
 agent = HoneypotAgent(memory_manager, persona_manager)
+analyzer = FusedAnalyzer() if os.getenv("FUSED_ANALYSIS", "0") == "1" else None
+callback_dispatcher = CallbackDispatcher()
+turn_coordinator = TurnCoordinator()
+engagement = EngagementTracker(memory_manager)
+pipeline = TurnPipeline(memory_manager, classifier, extractor, agent, analyzer=analyzer, engagement=engagement)
+# Turns it sheds get a local reply instead of waiting on a slow or rate-limited provider
+admission = AdmissionController(paused=lambda: gateway.paused_for)
+# Batch replay always packs messages into fused calls, independent of FUSED_ANALYSIS
+batch_processor = BatchProcessor(classifier, extractor, analyzer or FusedAnalyzer())
+BATCH_MAX_MESSAGES = int(os.getenv("BATCH_MAX_MESSAGES", "50000"))
+
+# Read whenever /metrics is scraped
+metrics.register_gauge("sessions_active", lambda: memory_manager.active_sessions)
+metrics.register_gauge("sessions_pending_writes", lambda: memory_manager.write_behind.pending if memory_manager.write_behind else 0)
+metrics.register_gauge("callback_queue_depth", lambda: callback_dispatcher.queue_depth)
+metrics.register_gauge("callback_inflight", lambda: callback_dispatcher.stats()["inflight"])
+metrics.register_gauge("llm_waiting", lambda: gateway.semaphore.waiting)
+metrics.register_gauge("turns_inflight", lambda: turn_coordinator.stats()["inflight"])
+metrics.register_gauge("result_cache", lambda: {k: v for k, v in result_cache.stats().items() if k in ("size", "hitRate")})
+metrics.register_gauge("admission_backlog", lambda: admission.backlog)
+metrics.register_gauge("log_dropped", lambda: DroppingQueueHandler.dropped)
 
 # Robust Request Model
 class HoneypotRequest(BaseModel):
@@ -70,12 +136,73 @@ async def root():
 async def honeypot_get():
     return {"message": "Honeypot Endpoint is Active. Send POST request with JSON body."}
 
+@app.get("/stats")
+async def stats():
+    return {"sessions": memory_manager.stats(), "resultCache": result_cache.stats(), "llm": gateway.stats(), "callbacks": callback_dispatcher.stats(), "turns": turn_coordinator.stats(), "intelIndex": intel_index.stats(), "admission": admission.stats()}
+
+@app.get("/intel/lookup")
+async def intel_lookup(value: str, kind: Optional[str] = None, x_api_key: Optional[str] = Header(None)):
+    """Sessions, hit count and first/last seen for one UPI ID, account, phone or link."""
+    if not is_authorized(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    if kind is not None and kind not in INDEXED_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(INDEXED_KINDS)}")
+    return {"matches": intel_index.lookup(value, kind)}
+
+@app.get("/intel/top")
+async def intel_top(n: int = 10, kind: Optional[str] = None, by: str = "sessions", x_api_key: Optional[str] = Header(None)):
+    """Most used identifiers across sessions, by distinct sessions or by hits."""
+    if not is_authorized(x_api_key):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    if kind is not None and kind not in INDEXED_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(INDEXED_KINDS)}")
+    if by not in ("sessions", "hits"):
+        raise HTTPException(status_code=400, detail="by must be sessions or hits")
+    return {"top": intel_index.top(max(1, min(n, MAX_TOP)), kind, by)}
+
+@app.get("/metrics")
+async def metrics_endpoint(format: str = "json"):
+    """
+    Per-stage latency histograms, LLM token/error/fallback counters, cache and
+    heuristic-skip rates, and gauges. ?format=prometheus for the text format.
+    """
+    if format == "prometheus":
+        return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+    return metrics.snapshot()
+
+def is_authorized(x_api_key: Optional[str]) -> bool:
+    return not APP_API_KEY or bool(x_api_key and x_api_key.strip() == APP_API_KEY.strip())
+
+def turn_priority(session_id: str) -> int:
+    extracted = memory_manager.get_extracted(session_id)
+    if any(extracted.get(kind) for kind in INDEXED_KINDS):
+        return PRIORITY_INTEL
+    if memory_manager.get_engagement(session_id) is not None:
+        return PRIORITY_ENGAGED
+    return PRIORITY_NEW
+
+def submit_callback(session_id: str, result: TurnResult):
+    try:
+        current_ext = memory_manager.get_extracted(session_id)
+        history_len = len(memory_manager.get_history(session_id))
+        agent_notes = f"Scam detected ({result.label}). Conf: {result.confidence}. Tier: {result.tier}"
+
+        callback_dispatcher.submit(
+            session_id=session_id,
+            scam_detected=True,
+            total_messages=history_len,
+            intelligence=current_ext,
+            agent_notes=agent_notes
+        )
+    except Exception as cb_e:
+        log.error("Callback submit failed", session=session_id, error=repr(cb_e))
+
 @app.post("/honeypot")
 @app.head("/honeypot", include_in_schema=False)
 async def honey_pot_endpoint(
     request: HoneypotRequest, 
-    background_tasks: BackgroundTasks, 
-    x_api_key: Optional[str] = Header(None)
+    x_api_key: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     response_data = {
         "status": "success",
@@ -83,15 +210,14 @@ async def honey_pot_endpoint(
     }
 
     # API Key Validation
-    if APP_API_KEY:
-        if not x_api_key or x_api_key.strip() != APP_API_KEY.strip():
-            print(f"[Auth] Invalid Key: {x_api_key}")
-            # Instead of returning 200 with error message, standard practice is 401 or 403,
-            # but to maintain 'confusion' for a honeypot, we might reply loosely.
-            # However, for the Hackathon Tester, explicit failure might be safely returned or logged.
-            # We will stick to the previous behavior: return 200 but say Authentication Failed.
-            response_data["reply"] = "Authentication Failed."
-            return response_data
+    if not is_authorized(x_api_key):
+        log.warning("Invalid API key", sampled=True)
+        # Instead of returning 200 with error message, standard practice is 401 or 403,
+        # but to maintain 'confusion' for a honeypot, we might reply loosely.
+        # However, for the Hackathon Tester, explicit failure might be safely returned or logged.
+        # We will stick to the previous behavior: return 200 but say Authentication Failed.
+        response_data["reply"] = "Authentication Failed."
+        return response_data
 
     # Extract ID and Message using the helper methods
     session_id = request.get_session_id()
@@ -101,46 +227,133 @@ async def honey_pot_endpoint(
         # If no message, just return default response
         return response_data
 
+    # One turn at a time per session; a retried/double-sent turn that is
+    # still in flight shares the original's reply instead of making a new one
+    return await turn_coordinator.run(
+        session_id, message_text, idempotency_key,
+        lambda: run_turn(session_id, message_text, response_data)
+    )
+
+async def run_turn(session_id: str, message_text: str, response_data: dict) -> dict:
     try:
-        is_scam, confidence, label = await classifier.classify(message_text)
-        
-        if is_scam:
-            new_ext = await extractor.extract(message_text)
-            memory_manager.update_extracted(session_id, new_ext)
-            
-            reply = await agent.generate_reply(session_id, message_text)
-            if reply:
-                response_data["reply"] = reply
-            
-            try:
-                current_ext = memory_manager.get_extracted(session_id)
-                history_len = 0
-                try:
-                     history_len = len(memory_manager.get_history(session_id))
-                except:
-                     pass
-
-                agent_notes = f"Scam detected ({label}). Conf: {confidence}"
-                
-                background_tasks.add_task(
-                    send_guvi_callback,
-                    session_id=session_id,
-                    scam_detected=True,
-                    total_messages=history_len,
-                    intelligence=current_ext,
-                    agent_notes=agent_notes
-                )
-            except Exception as cb_e:
-                print(f"Callback Error: {cb_e}")
-
-    except Exception as logic_e:
-        print(f"Logic Error: {logic_e}")
+        # Picks up the previous turn if another worker handled it, and keeps other workers off this session
+        async with memory_manager.turn(session_id):
+            with metrics.timer("turn"):
+                async with admission.admit(turn_priority(session_id)) as admitted:
+                    if admitted:
+                        result = await pipeline.run(session_id, message_text)
+                    else:
+                        result = pipeline.run_local(session_id, message_text)
+        metrics.incr("turns", result.tier)
+
+        # Shed turns the heuristic couldn't call still get a persona reply
+        if result.reply:
+            response_data["reply"] = result.reply
+        if result.is_scam:
+            submit_callback(session_id, result)
+
+    except Exception:
+        log.exception("Turn failed", session=session_id)
+        metrics.incr("turn_errors", "turn")
         # Consider whether to expose internal errors. For a honeypot, probably not.
     
     return response_data
 
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/honeypot/stream")
+async def honey_pot_stream(
+    request: HoneypotRequest,
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    Opt-in streaming variant of /honeypot over Server-Sent Events: "token"
+    events carry reply chunks as the model produces them, and a final "done"
+    event carries the full reply plus timings (ttfbMs = time to first token).
+    """
+    default_reply = "I did not understand that."
+    if not is_authorized(x_api_key):
+        log.warning("Invalid API key", sampled=True)
+        return {"status": "success", "reply": "Authentication Failed."}
+
+    session_id = request.get_session_id()
+    message_text = request.get_message_text()
+
+    async def events():
+        started = time.perf_counter()
+        first_token = None
+        result = None
+        if message_text.strip():
+            try:
+                # Streams can't be shared between retries, but they are still ordered per session
+                async with turn_coordinator.lock(session_id), memory_manager.turn(session_id):
+                    async with admission.admit(turn_priority(session_id)) as admitted:
+                        if admitted:
+                            async for kind, payload in pipeline.run_stream(session_id, message_text):
+                                if kind == "token":
+                                    if first_token is None:
+                                        first_token = time.perf_counter()
+                                    yield sse("token", {"text": payload})
+                                else:
+                                    result = payload
+                        else:
+                            result = pipeline.run_local(session_id, message_text)
+            except Exception:
+                log.exception("Streamed turn failed", session=session_id)
+                metrics.incr("turn_errors", "stream")
+
+        reply = default_reply
+        if result is not None:
+            metrics.incr("turns", result.tier)
+            reply = result.reply or default_reply
+        if result is not None and result.is_scam:
+            submit_callback(session_id, result)
+
+        ttfb_ms = round((first_token - started) * 1000, 1) if first_token else None
+        total_ms = round((time.perf_counter() - started) * 1000, 1)
+        if ttfb_ms is not None:
+            metrics.observe("stream-ttfb", ttfb_ms)
+        metrics.observe("stream", total_ms)
+        log.info("Streamed turn", session=session_id, ttfbMs=ttfb_ms, totalMs=total_ms, sampled=True)
+        yield sse("done", {"status": "success", "reply": reply, "ttfbMs": ttfb_ms, "totalMs": total_ms})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/honeypot/batch")
+async def honey_pot_batch(
+    request: Request,
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    Bulk replay of reported scam messages. Body is JSON lines (or a JSON
+    array) of message objects; results stream back as JSON lines, one per
+    input message, followed by a summary line with messages per second.
+    Does not touch conversation sessions.
+    """
+    if not is_authorized(x_api_key):
+        log.warning("Invalid API key", sampled=True)
+        return {"status": "success", "reply": "Authentication Failed."}
+
+    body = (await request.body()).decode("utf-8", errors="replace")
+    try:
+        items = parse_items(body, limit=BATCH_MAX_MESSAGES)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch body: {e}")
+
+    async def lines():
+        async for record in batch_processor.process(items):
+            yield json.dumps(record) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     # CRITICAL FIX: Use the PORT environment variable provided by Render
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    if WORKERS > 1:
+        # Worker processes import the app themselves, so it goes by name
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
@@ -1,55 +1,315 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import os
+import sys
 import time
+from storage import SessionBackend, Snapshot, WriteBehind
+from intel_index import IntelIndex
+
+INTEL_KEYS = ("bankAccounts", "upiIds", "phishingLinks", "phoneNumbers", "suspiciousKeywords")
+ROLES = {"user": sys.intern("user"), "assistant": sys.intern("assistant"), "system": sys.intern("system")}
+
+
+def empty_intel() -> Dict[str, list]:
+    return {k: [] for k in INTEL_KEYS}
+
+
+class Engagement:
+    # Sticky classification state of a session the honeypot is engaged with;
+    # see engagement.py for the transitions
+    __slots__ = ("label", "confidence", "since_check", "strikes")
+
+    def __init__(self, label: str, confidence: float, since_check: int = 0, strikes: int = 0):
+        self.label = sys.intern(label)
+        self.confidence = confidence
+        self.since_check = since_check # Turns since a classifier last confirmed it
+        self.strikes = strikes # Consecutive confident SAFE re-checks
+
+    def to_list(self) -> list:
+        return [self.label, self.confidence, self.since_check, self.strikes]
+
+
+class SessionRecord:
+    # Compact per-session state: history as (role, content) tuples with
+    # interned roles, intelligence only allocated once something is found and
+    # kept as insertion-ordered dicts so merges are O(1) membership checks
+    __slots__ = ("history", "extracted", "engagement", "last_access", "synced_at")
+
+    def __init__(self):
+        self.history: List[Tuple[str, str]] = []
+        self.extracted: Optional[Dict[str, Dict[str, None]]] = None
+        self.engagement: Optional[Engagement] = None
+        self.last_access = time.monotonic()
+        self.synced_at = 0.0 # Backend version this copy matches (shared mode)
+
+    def approx_bytes(self) -> int:
+        size = sys.getsizeof(self) + sys.getsizeof(self.history)
+        for role, content in self.history:
+            size += sys.getsizeof((role, content)) + sys.getsizeof(content)
+        if self.extracted:
+            size += sys.getsizeof(self.extracted)
+            for values in self.extracted.values():
+                size += sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values)
+        return size
+
 
 class MemoryManager:
-    # Keeps the chat history in memory. 
-    # TODO: Swap this with Redis/Postgres for production persistence.
-    def __init__(self, max_turns: int = 20):
-        self.sessions: Dict[str, List[Dict[str, str]]] = {}
-        self.session_data: Dict[str, Dict[str, str]] = {}
+    # Keeps the chat history in memory, bounded by a session cap (LRU) and an
+    # idle TTL so scanner traffic with throwaway session IDs can't grow it forever.
+    # With a backend, this becomes the hot cache: misses read through to the
+    # backend and writes are flushed to it in batches from a background thread.
+    # An index, when given, sees every identifier merged into a session.
+    # In shared mode (several workers on one backend) a turn runs inside
+    # turn(): it holds the session's lease across workers, starts with
+    # refresh() and ends with persist(), so whichever worker gets the next
+    # turn sees this one and never writes over it.
+    def __init__(self, max_turns: int = 20, max_sessions: Optional[int] = None, idle_ttl: Optional[float] = None,
+                 backend: Optional[SessionBackend] = None, index: Optional[IntelIndex] = None,
+                 shared: Optional[bool] = None):
         self.max_turns = max_turns
+        self.max_sessions = max_sessions if max_sessions is not None else int(os.getenv("SESSION_MAX", "10000"))
+        self.idle_ttl = idle_ttl if idle_ttl is not None else float(os.getenv("SESSION_IDLE_TTL", "21600"))
+        self._records: "OrderedDict[str, SessionRecord]" = OrderedDict()
+        # Sessions refresh() found in neither the cache nor the backend, so the
+        # turn's reads don't go back to the backend from the loop to confirm it
+        self._absent: "OrderedDict[str, None]" = OrderedDict()
+        self.evicted = 0
+        self.backend = backend
+        self.index = index
+        self.shared = backend is not None and (shared if shared is not None else os.getenv("SESSION_SHARED", "0") == "1")
+        self.write_behind = WriteBehind(backend, self._snapshot, on_flushed=self._flushed) if backend is not None else None
+        self.reloaded = 0
+        # Longer than any turn; a worker that dies mid-turn blocks the session this long
+        self.lease_ttl = float(os.getenv("SESSION_LEASE_TTL", "30"))
+        self.lease_waits = 0
+
+    def _get(self, session_id: str, create: bool = False) -> Optional[SessionRecord]:
+        now = time.monotonic()
+        record = self._records.get(session_id)
+        if record is not None and now - record.last_access > self.idle_ttl:
+            self._drop(session_id)
+            record = None
+
+        if record is None:
+            record = self._load(session_id) if session_id not in self._absent else None
+            if record is None:
+                if not create:
+                    return None
+                record = SessionRecord()
+            self._absent.pop(session_id, None)
+            self._records[session_id] = record
+            self._evict(now)
+        else:
+            self._records.move_to_end(session_id)
+        record.last_access = now
+        return record
+
+    def _evict(self, now: float):
+        # Least recently used sessions sit at the front, so idle ones are found there first
+        while self._records:
+            oldest_id, oldest = next(iter(self._records.items()))
+            if len(self._records) > self.max_sessions or now - oldest.last_access > self.idle_ttl:
+                self._drop(oldest_id)
+            else:
+                break
+
+    def _drop(self, session_id: str):
+        record = self._records.pop(session_id)
+        self.evicted += 1
+        # A clean copy is already in the backend, or older than what another worker wrote since
+        if self.write_behind is not None and self.write_behind.is_dirty(session_id):
+            self.write_behind.detach(session_id, self._to_snapshot(record))
+
+    def _load(self, session_id: str) -> Optional[SessionRecord]:
+        # Also runs on executor threads (refresh), so it must not touch _records
+        if self.backend is None:
+            return None
+        pending, snapshot = self.write_behind.peek(session_id)
+        synced_at = 0.0
+        if not pending:
+            if self.shared:
+                # Read before the load: a write landing in between only costs a reload
+                synced_at = self.backend.version(session_id) or 0.0
+            snapshot = self.backend.load(session_id)
+        if snapshot is None:
+            return None
+        record = SessionRecord()
+        record.synced_at = synced_at
+        history, extracted, engagement = snapshot
+        record.history = [(ROLES.get(role, role), content) for role, content in history]
+        record.extracted = {k: dict.fromkeys(v) for k, v in extracted.items()} if extracted else None
+        record.engagement = Engagement(*engagement) if engagement else None
+        return record
+
+    def _to_snapshot(self, record: SessionRecord) -> Snapshot:
+        # list()/dict copies so the flusher thread never sees a list mid-append
+        extracted = {k: list(v) for k, v in list(record.extracted.items())} if record.extracted else None
+        engagement = record.engagement.to_list() if record.engagement else None
+        return list(record.history), extracted, engagement
+
+    def _snapshot(self, session_id: str) -> Optional[Snapshot]:
+        record = self._records.get(session_id)
+        return self._to_snapshot(record) if record is not None else None
+
+    def _flushed(self, session_ids, stamp: float):
+        # Flusher thread; only plain attribute writes on records still cached
+        for session_id in session_ids:
+            record = self._records.get(session_id)
+            if record is not None and stamp > record.synced_at:
+                record.synced_at = stamp
+
+    async def refresh(self, session_id: str):
+        """
+        Brings the hot copy up to date before a turn, with the backend reads
+        in an executor so they never hold up the loop: loads a session that
+        isn't cached and, in shared mode, reloads one that another worker
+        wrote since we last synced.
+        """
+        if self.backend is None:
+            return
+        record = self._records.get(session_id)
+        if record is not None and time.monotonic() - record.last_access > self.idle_ttl:
+            self._drop(session_id)
+            record = None
+        if record is not None and (not self.shared or self.write_behind.is_dirty(session_id)):
+            return
+
+        loop = asyncio.get_running_loop()
+        if record is not None:
+            version = await loop.run_in_executor(None, self.backend.version, session_id)
+            if version is None or version <= record.synced_at:
+                return
+        loaded = await loop.run_in_executor(None, self._load, session_id)
+
+        # Anything the loop cached or wrote for this session meanwhile wins
+        if self._records.get(session_id) is not record or self.write_behind.is_dirty(session_id):
+            return
+        if record is not None:
+            del self._records[session_id]
+            self.reloaded += 1
+        if loaded is None:
+            self._absent[session_id] = None
+            self._absent.move_to_end(session_id)
+            while len(self._absent) > self.max_sessions:
+                self._absent.popitem(last=False)
+        else:
+            self._absent.pop(session_id, None)
+            now = time.monotonic()
+            loaded.last_access = now
+            self._records[session_id] = loaded
+            self._evict(now)
+
+    @asynccontextmanager
+    async def turn(self, session_id: str):
+        """
+        One turn on the session: refresh() before, persist() after and, in
+        shared mode, the backend's lease held throughout so no other worker
+        runs a turn on it at the same time. The lease belongs to the process;
+        ordering turns within it is TurnCoordinator's job.
+        """
+        loop = asyncio.get_running_loop()
+        if self.shared:
+            delay = 0.02
+            while not await loop.run_in_executor(None, self.backend.acquire, session_id, self.lease_ttl):
+                self.lease_waits += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+        try:
+            await self.refresh(session_id)
+            yield
+        finally:
+            try:
+                # Also after a failed turn: whatever it wrote must land before another worker reads
+                await self.persist(session_id)
+            finally:
+                if self.shared:
+                    await loop.run_in_executor(None, self.backend.release, session_id)
+
+    async def persist(self, session_id: str):
+        """In shared mode, waits until this session's pending writes are in the backend."""
+        if self.shared and self.write_behind.is_dirty(session_id):
+            await asyncio.get_running_loop().run_in_executor(None, self.write_behind.flush)
+
+    def _mark(self, session_id: str):
+        if self.write_behind is not None:
+            self.write_behind.mark(session_id)
 
     def get_history(self, session_id: str) -> List[Dict[str, str]]:
-        if session_id not in self.sessions:
-            self.sessions[session_id] = []
-        return self.sessions[session_id]
+        # Unknown sessions read as empty without being created
+        record = self._get(session_id)
+        if record is None:
+            return []
+        return [{"role": role, "content": content} for role, content in record.history]
 
     def add_message(self, session_id: str, role: str, content: str):
-        if session_id not in self.sessions:
-            self.sessions[session_id] = []
-        
-        self.sessions[session_id].append({"role": role, "content": content})
-        
+        record = self._get(session_id, create=True)
+        record.history.append((ROLES.get(role, role), content))
+
         # Trim if too long
-        if len(self.sessions[session_id]) > self.max_turns * 2: # *2 because user+assistant pairs
-             self.sessions[session_id] = self.sessions[session_id][-(self.max_turns * 2):]
+        if len(record.history) > self.max_turns * 2: # *2 because user+assistant pairs
+             del record.history[:-(self.max_turns * 2)]
+        self._mark(session_id)
 
     def clear_session(self, session_id: str):
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-        if session_id in self.session_data:
-            del self.session_data[session_id]
+        self._records.pop(session_id, None)
+        if self.write_behind is not None:
+            self.write_behind.delete(session_id)
 
     def update_extracted(self, session_id: str, data: Dict[str, list]):
-        if session_id not in self.session_data:
-            self.session_data[session_id] = {
-                "bankAccounts": [], "upiIds": [], "phishingLinks": [], 
-                "phoneNumbers": [], "suspiciousKeywords": []
-            }
-        
-        # Merge lists and ensure uniqueness
-        current = self.session_data[session_id]
+        if not data or not any(isinstance(v, list) and v for v in data.values()):
+            return
+        record = self._get(session_id, create=True)
+        if record.extracted is None:
+            record.extracted = {k: {} for k in INTEL_KEYS}
+
+        # Merge lists and ensure uniqueness; dict keys keep first-seen order
+        current = record.extracted
         for k, v_list in data.items():
             if v_list and isinstance(v_list, list):
-                # Add new items that aren't already there
-                existing = set(current.get(k, []))
-                for item in v_list:
-                    if item not in existing:
-                        current[k].append(item)
-                        existing.add(item)
+                current.setdefault(k, {}).update(dict.fromkeys(v_list))
+        self._mark(session_id)
+        if self.index is not None:
+            self.index.add(session_id, data)
 
     def get_extracted(self, session_id: str) -> Dict[str, list]:
-        return self.session_data.get(session_id, {
-            "bankAccounts": [], "upiIds": [], "phishingLinks": [], 
-            "phoneNumbers": [], "suspiciousKeywords": []
-        })
+        record = self._get(session_id)
+        if record is None or record.extracted is None:
+            return empty_intel()
+        return {k: list(v) for k, v in record.extracted.items()}
+
+    def get_engagement(self, session_id: str) -> Optional[Engagement]:
+        record = self._get(session_id)
+        return record.engagement if record is not None else None
+
+    def set_engagement(self, session_id: str, engagement: Optional[Engagement]):
+        record = self._get(session_id, create=engagement is not None)
+        if record is None:
+            return
+        record.engagement = engagement
+        self._mark(session_id)
+
+    @property
+    def active_sessions(self) -> int:
+        return len(self._records)
+
+    def stats(self) -> Dict[str, int]:
+        stats = {
+            "sessions": len(self._records),
+            "approxBytes": sum(r.approx_bytes() for r in self._records.values()),
+            "evicted": self.evicted,
+        }
+        if self.write_behind is not None:
+            stats["pendingWrites"] = self.write_behind.pending
+            stats["flushedWrites"] = self.write_behind.flushed
+            stats["flushErrors"] = self.write_behind.errors
+        if self.shared:
+            stats["reloaded"] = self.reloaded
+            stats["leaseWaits"] = self.lease_waits
+        return stats
+
+    def close(self):
+        # Final synchronous flush; call on shutdown
+        if self.write_behind is not None:
+            self.write_behind.close()
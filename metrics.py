@@ -0,0 +1,156 @@
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Upper bounds in milliseconds; wide enough to cover a regex pass and a slow LLM call
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; constant memory however many samples go in."""
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1) # Last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, ms: float):
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                break
+        else:
+            i = len(BUCKETS_MS)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        # Upper bound of the bucket holding the q-th sample; coarse but cheap
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "meanMs": round(self.total / self.count, 2) if self.count else None,
+            "p50Ms": self.quantile(0.5),
+            "p95Ms": self.quantile(0.95),
+            "p99Ms": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    In-process registry: per-stage latency histograms, counters labelled by
+    stage, and gauges read at snapshot time (active sessions, queue depths).
+    Everything is updated from the event loop, so no locking.
+    """
+    def __init__(self):
+        self.latency: Dict[str, Histogram] = {}
+        self.counters: Dict[str, Counter] = {}
+        self.gauges: Dict[str, Callable[[], Any]] = {}
+        self.started = time.time()
+
+    def observe(self, stage: str, ms: float):
+        histogram = self.latency.get(stage)
+        if histogram is None:
+            histogram = self.latency[stage] = Histogram()
+        histogram.observe(ms)
+
+    @contextmanager
+    def timer(self, stage: str):
+        # Only completed runs are recorded; failures show up in the error counters
+        # and cancelled speculative work would only skew the distribution
+        started = time.perf_counter()
+        yield
+        self.observe(stage, (time.perf_counter() - started) * 1000)
+
+    def incr(self, name: str, stage: str = "", n: int = 1):
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = Counter()
+        counter[stage] += n
+
+    def count(self, name: str, stage: Optional[str] = "") -> int:
+        """Counter value for one stage, or summed over every stage with stage=None."""
+        counter = self.counters.get(name)
+        if not counter:
+            return 0
+        return sum(counter.values()) if stage is None else counter[stage]
+
+    def reset(self):
+        # Histograms and counters only; gauges stay registered
+        self.latency.clear()
+        self.counters.clear()
+        self.started = time.time()
+
+    def register_gauge(self, name: str, read: Callable[[], Any]):
+        self.gauges[name] = read
+
+    def rates(self) -> Dict[str, Optional[float]]:
+        decided, ambiguous = self.count("heuristic", "decided"), self.count("heuristic", "ambiguous")
+        scans = self.latency["extract-regex"].count if "extract-regex" in self.latency else 0
+        return {
+            # Share of messages the local tier classified without the LLM
+            "heuristicSkip": round(decided / (decided + ambiguous), 4) if decided + ambiguous else None,
+            # Share of extractions where the regex pass was complete enough to skip the LLM
+            "extractLlmSkip": round(self.count("extract_llm_skipped", "extract") / scans, 4) if scans else None,
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        gauges = {}
+        for name, read in self.gauges.items():
+            try:
+                gauges[name] = read()
+            except Exception as e:
+                gauges[name] = f"error: {e}"
+        return {
+            "uptimeSeconds": round(time.time() - self.started, 1),
+            "latency": {stage: h.snapshot() for stage, h in sorted(self.latency.items())},
+            "counters": {name: dict(counter) for name, counter in sorted(self.counters.items())},
+            "rates": self.rates(),
+            "gauges": gauges,
+        }
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = ["# TYPE honeypot_stage_latency_ms histogram"]
+        for stage, h in sorted(self.latency.items()):
+            seen = 0
+            for bound, n in zip(BUCKETS_MS + ("+Inf",), h.counts):
+                seen += n
+                lines.append(f'honeypot_stage_latency_ms_bucket{{stage="{stage}",le="{bound}"}} {seen}')
+            lines.append(f'honeypot_stage_latency_ms_sum{{stage="{stage}"}} {h.total:.3f}')
+            lines.append(f'honeypot_stage_latency_ms_count{{stage="{stage}"}} {h.count}')
+        for name, counter in sorted(self.counters.items()):
+            lines.append(f"# TYPE honeypot_{name}_total counter")
+            for stage, n in sorted(counter.items()):
+                lines.append(f'honeypot_{name}_total{{stage="{stage}"}} {n}')
+        for name, value in _flatten(self.snapshot()["gauges"]):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE honeypot_{name} gauge")
+                lines.append(f"honeypot_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _flatten(values: Dict[str, Any], prefix: str = "") -> List[Tuple[str, Any]]:
+    flat = []
+    for key, value in values.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.extend(_flatten(value, f"{name}_"))
+        else:
+            flat.append((name, value))
+    return flat
+
+
+# One registry for the whole process
+metrics = Metrics()
@@ -1,5 +1,7 @@
 from dataclasses import dataclass
-import random
+from typing import Optional, Tuple
+import hashlib
+import os
 
 @dataclass
 class Persona:
@@ -8,40 +10,64 @@ class Persona:
     city: str
     occupation: str
     background: str
+    # Used by the local reply generator (local_replies.py)
+    relative: str = "my son"
+    asides: Tuple[str, ...] = ()
 
 class PersonaManager:
-    def __init__(self):
+    def __init__(self, key: Optional[str] = None):
+        # Keyed so session IDs can't be crafted to pick a persona; any fixed
+        # key keeps assignment stable across workers and restarts
+        key = key if key is not None else os.getenv("PERSONA_KEY", "")
+        self._key = key.encode("utf-8")[:64]
         self._personas = [
             Persona(
                 name="Ramesh Gupta",
                 age=58,
                 city="Mumbai",
                 occupation="Retired Bank Clerk",
-                background="Not very tech savvy. Uses a basic smartphone. Worried about his pension. Wants to be helpful but easily confused by digital payments."
+                background="Not very tech savvy. Uses a basic smartphone. Worried about his pension. Wants to be helpful but easily confused by digital payments.",
+                relative="my son Amit",
+                asides=("My pension only comes on the 1st.", "These new phones are too complicated for me.",
+                        "In my bank days we did everything on paper only.")
             ),
             Persona(
                 name="Sunita Sharma",
                 age=45,
                 city="Delhi",
                 occupation="Housewife",
-                background="Uses WhatsApp a lot but doesn't understand UPI well. Very polite. Afraid of doing something wrong with money."
+                background="Uses WhatsApp a lot but doesn't understand UPI well. Very polite. Afraid of doing something wrong with money.",
+                relative="my husband",
+                asides=("Sorry ji, I was in the kitchen.", "My husband handles all the bank work normally.",
+                        "Please don't be angry, I am trying.")
             ),
              Persona(
                 name="Rajesh Kumar",
                 age=62,
                 city="Bangalore",
                 occupation="Shopkeeper",
-                background="Busy with his shop. Gets easily distracted. Asks for simple instructions repeatedly. Wants to verify everything twice."
+                background="Busy with his shop. Gets easily distracted. Asks for simple instructions repeatedly. Wants to verify everything twice.",
+                relative="my nephew",
+                asides=("One minute, customer is here.", "Sorry, shop is very busy today.",
+                        "I am writing everything in my account book.")
             )
         ]
+        # Built once; the prompt for a persona never changes
+        self._prompts = [self._build_prompt(p) for p in self._personas]
+
+    def _index(self, session_id: str) -> int:
+        # Not hash(): that is salted per process, so workers and restarts disagree
+        digest = hashlib.blake2b(session_id.encode("utf-8"), key=self._key, digest_size=8).digest()
+        return int.from_bytes(digest, "big") % len(self._personas)
 
     def get_persona(self, session_id: str) -> Persona:
-        # Simple deterministic selection based on session_id hash
-        idx = hash(session_id) % len(self._personas)
-        return self._personas[idx]
+        return self._personas[self._index(session_id)]
 
     def get_system_prompt(self, session_id: str) -> str:
-        p = self.get_persona(session_id)
+        return self._prompts[self._index(session_id)]
+
+    @staticmethod
+    def _build_prompt(p: Persona) -> str:
         return (
             f"You are {p.name}, a {p.age}-year-old {p.occupation} from {p.city}. "
             f"{p.background}\n\n"
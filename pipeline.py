@@ -0,0 +1,264 @@
+import asyncio
+import os
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional, Tuple
+from memory import MemoryManager
+from classifier import ScamClassifier
+from extractor import IntelligenceExtractor, extract_regex
+from agents import HoneypotAgent
+from analyzer import FusedAnalyzer
+from engagement import EngagementTracker
+from logs import get_logger
+from metrics import metrics
+
+log = get_logger("pipeline")
+
+
+def default_budget() -> Dict[str, float]:
+    # Seconds each stage may take before we give up on it and use its default
+    return {
+        "classify": float(os.getenv("STAGE_TIMEOUT_CLASSIFY", "8")),
+        "analyze": float(os.getenv("STAGE_TIMEOUT_ANALYZE", "10")),
+        "extract": float(os.getenv("STAGE_TIMEOUT_EXTRACT", "8")),
+        "reply": float(os.getenv("STAGE_TIMEOUT_REPLY", "12")),
+    }
+
+
+@dataclass
+class TurnResult:
+    is_scam: bool
+    confidence: float
+    label: str
+    tier: str
+    reply: Optional[str] = None
+    extracted: Dict[str, list] = field(default_factory=dict)
+
+
+class TurnPipeline:
+    """
+    Runs classify -> extract -> reply for one message.
+
+    In "speculative" mode (default) extraction and reply generation start
+    alongside the LLM classifier and are cancelled if the message comes back
+    SAFE, so a scam turn costs roughly one LLM round trip instead of three.
+    "serial" mode keeps the original one-after-another behaviour. With an
+    analyzer, classification and extraction are fused into a single call.
+    With an engagement tracker, sessions already judged a scam skip
+    classification except for periodic re-checks (tier "engaged").
+    """
+    def __init__(self, memory_manager: MemoryManager, classifier: ScamClassifier,
+                 extractor: IntelligenceExtractor, agent: HoneypotAgent, mode: Optional[str] = None,
+                 analyzer: Optional[FusedAnalyzer] = None, engagement: Optional[EngagementTracker] = None):
+        self.memory = memory_manager
+        self.classifier = classifier
+        self.extractor = extractor
+        self.agent = agent
+        self.mode = mode or os.getenv("PIPELINE_MODE", "speculative")
+        # When set, ambiguous messages are classified and extracted in one LLM call
+        self.analyzer = analyzer
+        self.engagement = engagement
+
+    async def run(self, session_id: str, text: str, budget: Optional[Dict[str, float]] = None) -> TurnResult:
+        budget = {**default_budget(), **(budget or {})}
+
+        verdict, tier = self._local_verdict(session_id, text)
+        if verdict is not None:
+            is_scam, confidence, label = verdict
+            if not is_scam:
+                return TurnResult(is_scam, confidence, label, tier)
+            extracted, reply = await asyncio.gather(
+                self._stage("extract", self.extractor.extract(text), budget, text=text),
+                self._stage("reply", self.agent.draft_reply(session_id, text), budget, text=text, session_id=session_id),
+            )
+            return self._commit(session_id, text, TurnResult(is_scam, confidence, label, tier, reply, extracted))
+
+        speculative = self.mode != "serial"
+        fused = self.analyzer is not None
+
+        # Speculative: later stages start now, classification decides what we keep
+        extract_task = None
+        reply_task = None
+        if speculative:
+            if not fused:
+                extract_task = asyncio.create_task(self._stage("extract", self.extractor.extract(text), budget, text=text))
+            reply_task = asyncio.create_task(self._stage("reply", self.agent.draft_reply(session_id, text), budget, text=text, session_id=session_id))
+        pending = [t for t in (extract_task, reply_task) if t]
+
+        try:
+            if fused:
+                (is_scam, confidence, label), extracted = await self._stage("analyze", self._analyze(text), budget, text=text)
+            else:
+                is_scam, confidence, label = await self._stage("classify", self.classifier._classify_llm(text), budget)
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            raise
+
+        (is_scam, confidence, label), tier = self._observe(session_id, (is_scam, confidence, label))
+        if not is_scam:
+            for task in pending:
+                task.cancel()
+            return TurnResult(is_scam, confidence, label, tier)
+
+        if not fused:
+            extracted = await (extract_task or self._stage("extract", self.extractor.extract(text), budget, text=text))
+        reply = await (reply_task or self._stage("reply", self.agent.draft_reply(session_id, text), budget, text=text, session_id=session_id))
+        return self._commit(session_id, text, TurnResult(is_scam, confidence, label, tier, reply, extracted))
+
+    def run_local(self, session_id: str, text: str) -> TurnResult:
+        """
+        A turn with no LLM calls at all, for when admission control sheds it:
+        heuristic or sticky verdict, regex extraction and a local persona
+        reply. Messages only the LLM could classify get the persona reply
+        too, so the conversation keeps going, but stay UNKNOWN (not a scam,
+        no callback) until a turn that gets the LLM decides.
+        """
+        verdict, _ = self._local_verdict(session_id, text)
+        if verdict is None and self.engagement:
+            # Due for a re-check; that waits for a turn that gets the LLM
+            engagement = self.engagement.get(session_id)
+            if engagement is not None:
+                verdict = True, engagement.confidence, engagement.label
+        if verdict is not None and not verdict[0]:
+            return TurnResult(*verdict, "local")
+        reply = self.agent.fallback_reply(session_id, text)
+        if verdict is None:
+            return self._commit(session_id, text, TurnResult(False, 0.0, "UNKNOWN", "local", reply, extract_regex(text)))
+        return self._commit(session_id, text, TurnResult(*verdict, "local", reply, extract_regex(text)))
+
+    def _local_verdict(self, session_id: str, text: str) -> Tuple[Optional[Tuple[bool, float, str]], str]:
+        """
+        Verdict that needs no LLM call, with its tier: the heuristic's, or the
+        sticky one of an engaged session. None when the LLM has to decide.
+        """
+        verdict = self.classifier.heuristic.classify(text)
+        engagement = self.engagement.get(session_id) if self.engagement else None
+        if engagement is None:
+            if verdict is not None and verdict[0] and self.engagement:
+                self.engagement.observe(session_id, verdict)
+            return verdict, "heuristic"
+        if verdict is not None and verdict[0]:
+            self.engagement.observe(session_id, verdict) # Confirms for free
+            return verdict, "heuristic"
+        if not self.engagement.due(engagement):
+            return self.engagement.skip(session_id, engagement), "engaged"
+        # Due for a re-check: an LLM verdict, even if the heuristic says SAFE
+        return None, "llm"
+
+    def _observe(self, session_id: str, verdict: Tuple[bool, float, str]) -> Tuple[Tuple[bool, float, str], str]:
+        if self.engagement is None:
+            return verdict, "llm"
+        engagement = self.engagement.observe(session_id, verdict)
+        if not verdict[0] and engagement is not None:
+            # Engaged sessions keep talking through a lone SAFE or a failed re-check
+            return (True, engagement.confidence, engagement.label), "engaged"
+        return verdict, "llm"
+
+    async def _analyze(self, text: str) -> Tuple[Tuple[bool, float, str], Dict[str, list]]:
+        fused = await self.analyzer.analyze(text)
+        if fused is None:
+            # Malformed or failed fused output: fall back to the two separate calls
+            verdict, extracted = await asyncio.gather(self.classifier._classify_llm(text), self.extractor.extract(text))
+            return verdict, extracted
+
+        verdict, llm_data = fused
+        return verdict, self.extractor.merge(extract_regex(text), llm_data)
+
+    async def run_stream(self, session_id: str, text: str, budget: Optional[Dict[str, float]] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streaming run(): yields ("token", str) for each reply chunk, then a
+        final ("result", TurnResult). The reply stream starts speculatively
+        with classification and is buffered until the message is confirmed
+        as a scam, so nothing is sent for SAFE messages.
+        """
+        budget = {**default_budget(), **(budget or {})}
+
+        verdict, tier = self._local_verdict(session_id, text)
+        if verdict is not None and not verdict[0]:
+            yield "result", TurnResult(*verdict, tier)
+            return
+
+        chunks: asyncio.Queue = asyncio.Queue()
+        pump = asyncio.create_task(self._pump(session_id, text, self.agent.stream_reply(session_id, text), chunks, budget))
+        fused = verdict is None and self.analyzer is not None
+        extract_task = None if fused else asyncio.create_task(
+            self._stage("extract", self.extractor.extract(text), budget, text=text))
+
+        try:
+            if verdict is not None:
+                (is_scam, confidence, label), extracted = verdict, None
+            else:
+                if fused:
+                    llm_verdict, extracted = await self._stage("analyze", self._analyze(text), budget, text=text)
+                else:
+                    llm_verdict, extracted = await self._stage("classify", self.classifier._classify_llm(text), budget), None
+                (is_scam, confidence, label), tier = self._observe(session_id, llm_verdict)
+
+            if not is_scam:
+                pump.cancel()
+                if extract_task:
+                    extract_task.cancel()
+                yield "result", TurnResult(is_scam, confidence, label, tier)
+                return
+
+            parts = []
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                parts.append(chunk)
+                yield "token", chunk
+
+            if extracted is None:
+                extracted = await extract_task
+            result = TurnResult(is_scam, confidence, label, tier, "".join(parts), extracted)
+            yield "result", self._commit(session_id, text, result)
+        finally:
+            # Client went away or something failed: don't leave work running
+            pump.cancel()
+            if extract_task:
+                extract_task.cancel()
+
+    async def _pump(self, session_id: str, text: str, stream: AsyncIterator[str], chunks: asyncio.Queue, budget: Dict[str, float]):
+        produced = False
+
+        async def consume():
+            nonlocal produced
+            async for chunk in stream:
+                produced = True
+                chunks.put_nowait(chunk)
+
+        try:
+            await asyncio.wait_for(consume(), timeout=budget["reply"])
+        except asyncio.TimeoutError:
+            log.warning("Reply stream exceeded budget", session=session_id, budget=budget["reply"])
+            metrics.incr("timeouts", "reply")
+            if not produced:
+                chunks.put_nowait(self.agent.fallback_reply(session_id, text))
+        finally:
+            chunks.put_nowait(None)
+
+    def _commit(self, session_id: str, text: str, result: TurnResult) -> TurnResult:
+        self.memory.update_extracted(session_id, result.extracted)
+        if result.reply:
+            self.agent.commit_reply(session_id, text, result.reply)
+        return result
+
+    async def _stage(self, stage: str, coro: Awaitable, budget: Dict[str, float],
+                     text: str = "", session_id: str = "") -> Any:
+        try:
+            return await asyncio.wait_for(coro, timeout=budget[stage])
+        except asyncio.TimeoutError:
+            log.warning("Stage exceeded budget, using default", stage=stage, budget=budget[stage])
+            metrics.incr("timeouts", stage)
+            return self._default(stage, text, session_id)
+
+    def _default(self, stage: str, text: str, session_id: str) -> Any:
+        if stage == "classify":
+            return False, 0.0, "SAFE"
+        if stage == "analyze":
+            return (False, 0.0, "SAFE"), {}
+        if stage == "extract":
+            # Regex pass is local and instant, so a timed out LLM still leaves us something
+            return extract_regex(text)
+        return self.agent.fallback_reply(session_id, text)
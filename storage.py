@@ -0,0 +1,301 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from logs import get_logger
+
+log = get_logger("storage")
+
+# (history as (role, content) pairs, extracted intelligence or None,
+#  sticky classification state as [label, confidence, since_check, strikes] or None)
+Snapshot = Tuple[List[Tuple[str, str]], Optional[Dict[str, list]], Optional[list]]
+
+
+class SessionBackend:
+    """
+    Where MemoryManager persists sessions. Implementations only need point
+    loads and batched writes; MemoryManager keeps the hot copies in front.
+    """
+    def load(self, session_id: str) -> Optional[Snapshot]:
+        raise NotImplementedError
+
+    def write_batch(self, snapshots: Dict[str, Optional[Snapshot]]) -> float:
+        """
+        Upserts every snapshot in one go; a None snapshot deletes the session.
+        Returns the write's timestamp, as later reported by version().
+        """
+        raise NotImplementedError
+
+    def version(self, session_id: str) -> Optional[float]:
+        """When the session was last written by anyone; None if unknown or unsupported."""
+        return None
+
+    def acquire(self, session_id: str, ttl: float) -> bool:
+        """
+        Takes (or extends) this process's lease on the session for `ttl`
+        seconds; False while another process holds an unexpired one.
+        Backends only one process uses can always say yes.
+        """
+        return True
+
+    def release(self, session_id: str):
+        pass
+
+    def close(self):
+        pass
+
+
+class InMemoryBackend(SessionBackend):
+    # Process-local stand-in, mainly useful to exercise the write-behind path
+    def __init__(self):
+        self._data: Dict[str, Snapshot] = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Optional[Snapshot]:
+        with self._lock:
+            return self._data.get(session_id)
+
+    def write_batch(self, snapshots: Dict[str, Optional[Snapshot]]) -> float:
+        with self._lock:
+            for session_id, snapshot in snapshots.items():
+                if snapshot is None:
+                    self._data.pop(session_id, None)
+                else:
+                    self._data[session_id] = snapshot
+        return time.time()
+
+
+class SQLiteBackend(SessionBackend):
+    """
+    SQLite in WAL mode: readers don't block the flusher and several uvicorn
+    workers on one host can share the same file. Reads use their own
+    connection, so a point load never waits behind a batch transaction.
+    Workers serialize turns on a session through a lease row, so two of them
+    can't each write their own version of the history over the other's.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " history TEXT NOT NULL,"
+            " extracted TEXT,"
+            " engagement TEXT,"
+            " updated_at REAL NOT NULL)"
+        )
+        # Files created before the engagement column existed
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if "engagement" not in columns:
+            try:
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN engagement TEXT")
+            except sqlite3.OperationalError:
+                pass # Another worker added it first
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_leases ("
+            " session_id TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._read_conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+
+    def load(self, session_id: str) -> Optional[Snapshot]:
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT history, extracted, engagement FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        history = [tuple(item) for item in json.loads(row[0])]
+        extracted = json.loads(row[1]) if row[1] else None
+        engagement = json.loads(row[2]) if row[2] else None
+        return history, extracted, engagement
+
+    def write_batch(self, snapshots: Dict[str, Optional[Snapshot]]) -> float:
+        now = time.time()
+        upserts = []
+        deletes = []
+        for session_id, snapshot in snapshots.items():
+            if snapshot is None:
+                deletes.append((session_id,))
+            else:
+                history, extracted, engagement = snapshot
+                upserts.append((session_id, json.dumps(history), json.dumps(extracted) if extracted else None,
+                                json.dumps(engagement) if engagement else None, now))
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if upserts:
+                    self._conn.executemany(
+                        "INSERT INTO sessions (session_id, history, extracted, engagement, updated_at) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(session_id) DO UPDATE SET history = excluded.history, "
+                        "extracted = excluded.extracted, engagement = excluded.engagement, "
+                        "updated_at = excluded.updated_at",
+                        upserts,
+                    )
+                if deletes:
+                    self._conn.executemany("DELETE FROM sessions WHERE session_id = ?", deletes)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return now
+
+    def version(self, session_id: str) -> Optional[float]:
+        with self._read_lock:
+            row = self._read_conn.execute("SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def acquire(self, session_id: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO session_leases (session_id, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE session_leases.owner = excluded.owner OR session_leases.expires_at < ?",
+                (session_id, self.owner, now + ttl, now),
+            )
+        return cursor.rowcount > 0
+
+    def release(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_leases WHERE session_id = ? AND owner = ?", (session_id, self.owner))
+
+    def close(self):
+        with self._read_lock:
+            self._read_conn.close()
+        with self._lock:
+            self._conn.close()
+
+
+def make_backend() -> Optional[SessionBackend]:
+    """Backend selected by SESSION_BACKEND (none | memory | sqlite)."""
+    kind = os.getenv("SESSION_BACKEND", "none").lower()
+    if kind == "sqlite":
+        return SQLiteBackend(os.getenv("SESSION_DB_PATH", "sessions.db"))
+    if kind == "memory":
+        return InMemoryBackend()
+    return None
+
+
+# Marks a dirty session whose current state should be read from the hot cache at flush time
+_LIVE = object()
+
+
+class WriteBehind:
+    """
+    Collects dirty sessions and flushes them to the backend from a background
+    thread, so add_message/update_extracted never wait on storage. Repeated
+    writes to one session between flushes collapse into a single row write.
+    """
+    def __init__(self, backend: SessionBackend, snapshot, interval: Optional[float] = None, max_batch: Optional[int] = None,
+                 on_flushed=None):
+        self.backend = backend
+        self._snapshot = snapshot # session_id -> Optional[Snapshot] from the hot cache
+        self._on_flushed = on_flushed # (session_ids, write timestamp), called on the flushing thread
+        self.interval = interval if interval is not None else float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5"))
+        self.max_batch = max_batch if max_batch is not None else int(os.getenv("SESSION_FLUSH_BATCH", "500"))
+        self._dirty: Dict[str, object] = {}
+        self._flushing: Dict[str, Optional[Snapshot]] = {} # batch currently being written
+        self._lock = threading.Lock()
+        # One flush at a time, so an older snapshot can't land after a newer one
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.flushed = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name="session-write-behind", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    def mark(self, session_id: str):
+        self._put(session_id, _LIVE)
+
+    def delete(self, session_id: str):
+        self._put(session_id, None)
+
+    def detach(self, session_id: str, snapshot: Snapshot):
+        # Session is leaving the hot cache; its final state goes out with the
+        # next batch instead of being read from the cache at flush time
+        self._put(session_id, snapshot)
+
+    def is_dirty(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._dirty or session_id in self._flushing
+
+    def peek(self, session_id: str) -> Tuple[bool, Optional[Snapshot]]:
+        """(True, snapshot) if an unflushed detached or deleted state exists for this session."""
+        with self._lock:
+            value = self._dirty.get(session_id, _LIVE)
+            if value is _LIVE and session_id in self._flushing:
+                value = self._flushing[session_id]
+        if value is _LIVE:
+            return False, None
+        return True, value
+
+    def _put(self, session_id: str, value: object):
+        with self._lock:
+            self._dirty[session_id] = value
+            if len(self._dirty) >= self.max_batch:
+                self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+
+        batch = {}
+        for session_id, value in dirty.items():
+            if value is _LIVE:
+                value = self._snapshot(session_id)
+                if value is None:
+                    continue # Expired from the hot cache; nothing newer to write
+            batch[session_id] = value
+
+        with self._lock:
+            self._flushing = batch
+        try:
+            stamp = self.backend.write_batch(batch)
+            self.flushed += len(batch)
+            if self._on_flushed is not None:
+                self._on_flushed(batch.keys(), stamp)
+        except Exception as e:
+            self.errors += 1
+            log.error("Session flush failed", sessions=len(batch), error=repr(e))
+            # Put them back unless a newer write already did
+            with self._lock:
+                for session_id, value in batch.items():
+                    self._dirty.setdefault(session_id, value)
+        finally:
+            with self._lock:
+                self._flushing = {}
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+        self.backend.close()
@@ -0,0 +1,23 @@
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.mock_llm import serve_in_thread  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def mock_server():
+    port = free_port()
+    server = serve_in_thread(port)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
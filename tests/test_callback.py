@@ -0,0 +1,141 @@
+import asyncio
+import os
+import time
+
+import httpx
+import pytest
+
+from callback import CallbackDispatcher
+
+INTEL = {"upiIds": ["fraud@ybl"], "suspiciousKeywords": ["urgent"]}
+
+
+@pytest.fixture
+def sink(mock_server):
+    """The mock's /callback endpoint, reset and answering 200."""
+    httpx.post(f"{mock_server}/reset")
+    httpx.post(f"{mock_server}/config", json={"callback_statuses": []})
+    return mock_server
+
+
+def script(base: str, *statuses: int):
+    httpx.post(f"{base}/config", json={"callback_statuses": list(statuses)})
+
+
+def received(base: str) -> list:
+    return httpx.get(f"{base}/callbacks").json()
+
+
+def attempts(base: str) -> int:
+    return httpx.get(f"{base}/stats").json()["calls"].get("callback", 0)
+
+
+async def wait_for(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+def dispatcher(base: str, spool_dir: str, **kwargs) -> CallbackDispatcher:
+    kwargs.setdefault("debounce", 0.3)
+    kwargs.setdefault("max_retries", 3)
+    return CallbackDispatcher(url=f"{base}/callback", spool_dir=spool_dir, **kwargs)
+
+
+def test_retries_with_backoff_until_delivered(sink, tmp_path):
+    script(sink, 503, 500)
+
+    async def run():
+        d = dispatcher(sink, str(tmp_path))
+        await d.start()
+        started = time.monotonic()
+        d.submit("s1", True, 4, INTEL)
+        await wait_for(lambda: d.sent == 1)
+        elapsed = time.monotonic() - started
+        await d.stop()
+        return d, elapsed
+
+    d, elapsed = asyncio.run(run())
+    assert attempts(sink) == 3
+    assert [p["sessionId"] for p in received(sink)] == ["s1"]
+    # Two backoff sleeps: 0.5s and 1s, each with up to 50% jitter
+    assert elapsed >= 1.5
+    assert d.failed == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_client_error_is_not_retried(sink, tmp_path):
+    script(sink, 400)
+
+    async def run():
+        d = dispatcher(sink, str(tmp_path))
+        await d.start()
+        d.submit("s1", True, 4, INTEL)
+        await wait_for(lambda: d.failed == 1)
+        await d.stop()
+        return d
+
+    d = asyncio.run(run())
+    assert attempts(sink) == 1
+    assert received(sink) == []
+    assert d.sent == 0
+    # Resending a rejected payload won't help, so it isn't kept for the next start either
+    assert os.listdir(tmp_path) == []
+
+
+def test_unchanged_updates_coalesce_and_debounce(sink, tmp_path):
+    async def run():
+        d = dispatcher(sink, str(tmp_path), debounce=0.3)
+        await d.start()
+        d.submit("s1", True, 2, INTEL)
+        await wait_for(lambda: d.sent == 1)
+
+        # Same intelligence, only the message count moves: held back while they keep coming
+        last = None
+        for count in (4, 6, 8):
+            d.submit("s1", True, count, INTEL)
+            last = time.monotonic()
+            await asyncio.sleep(0.2)
+        assert d.sent == 1
+        await wait_for(lambda: d.sent == 2)
+        quiet = time.monotonic() - last
+
+        # New intelligence skips the wait
+        d.submit("s1", True, 10, {**INTEL, "phoneNumbers": ["+919876543210"]})
+        await asyncio.sleep(0.1)
+        sent_new = d.sent
+        await d.stop()
+        return quiet, sent_new
+
+    quiet, sent_new = asyncio.run(run())
+    assert quiet >= 0.25
+    assert sent_new == 3
+    counts = [p["totalMessagesExchanged"] for p in received(sink)]
+    assert counts == [2, 8, 10]
+
+
+def test_undelivered_payload_is_spooled_and_reloaded(sink, tmp_path):
+    script(sink, 503, 503)
+
+    async def first_run():
+        d = dispatcher(sink, str(tmp_path), max_retries=0)
+        await d.start()
+        d.submit("s1", True, 6, INTEL)
+        await wait_for(lambda: d.failed == 1)
+        await d.stop() # Final attempt gets the second 503
+        return d
+
+    d = asyncio.run(first_run())
+    assert d.sent == 0
+    assert len(os.listdir(tmp_path)) == 1
+
+    async def second_run():
+        d = dispatcher(sink, str(tmp_path))
+        await d.start()
+        await wait_for(lambda: d.sent == 1)
+        await d.stop()
+
+    asyncio.run(second_run())
+    assert [(p["sessionId"], p["totalMessagesExchanged"]) for p in received(sink)] == [("s1", 6)]
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class TurnCoordinator:
+    """
+    Serializes turns per session and collapses duplicate turns.
+
+    Each session gets its own lock while anyone holds or waits on it; the
+    entry is dropped when the last user leaves, so the table only holds
+    sessions with a turn in progress. A turn is identified by the client's
+    Idempotency-Key or, failing that, a hash of the message text; a retry of a
+    turn that is still in flight awaits the original instead of generating a
+    second reply. Results for explicit idempotency keys are also remembered
+    for a short window so a retry that lands just after completion is served
+    from memory.
+    """
+    def __init__(self, replay_window: Optional[float] = None, max_replays: int = 10000):
+        self.replay_window = replay_window if replay_window is not None else float(os.getenv("TURN_REPLAY_WINDOW", "30"))
+        self.max_replays = max_replays
+        # session_id -> (lock, number of turns holding or waiting on it)
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._replays: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self.deduped = 0
+
+    @asynccontextmanager
+    async def lock(self, session_id: str):
+        lock, users = self._locks.get(session_id) or (asyncio.Lock(), 0)
+        self._locks[session_id] = lock, users + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[session_id]
+            if users == 1:
+                del self._locks[session_id]
+            else:
+                self._locks[session_id] = lock, users - 1
+
+    def turn_key(self, session_id: str, text: str, idempotency_key: Optional[str] = None) -> Tuple[str, str]:
+        if idempotency_key:
+            return session_id, f"key:{idempotency_key}"
+        return session_id, "sha:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    async def run(self, session_id: str, text: str, idempotency_key: Optional[str],
+                  factory: Callable[[], Awaitable[Any]]) -> Any:
+        key = self.turn_key(session_id, text, idempotency_key)
+        while True:
+            replay = self._replays.get(key)
+            if replay is not None:
+                if replay[0] > time.monotonic():
+                    self.deduped += 1
+                    return replay[1]
+                del self._replays[key]
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                result = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise # We were cancelled ourselves
+                continue # The original was cancelled; run the turn ourselves
+            self.deduped += 1
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            async with self.lock(session_id):
+                result = await factory()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # Waiters still get it; silences "never retrieved"
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            if idempotency_key and self.replay_window > 0:
+                self._remember(key, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def _remember(self, key: Tuple[str, str], result: Any):
+        self._replays[key] = (time.monotonic() + self.replay_window, result)
+        self._replays.move_to_end(key)
+        while len(self._replays) > self.max_replays:
+            self._replays.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": len(self._inflight), "locked": len(self._locks), "deduped": self.deduped}